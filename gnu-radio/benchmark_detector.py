@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+from optparse import OptionParser
+from gnuradio import analog
+from gnuradio import blocks
+from gnuradio import fft
+from gnuradio import gr
+from gnuradio.fft import window
+from dvbt_blocks import energy_detector
+import os
+import tempfile
+import time
+import numpy as np
+
+# Variables
+fft_size = 1024		# FFT size of the scanner
+samples = 100000000	# Amount of samples pushed trough the chains
+generate_samples = 10000000	# Length of the generated noise file when no input file is given
+repeat = 3		# Amount of runs per chain, the fastest is used
+input_file = None	# The complex64 sample file, generated noise when not given
+
+# Level chain of the scanner before the energy detector block
+def old_chain(tb, src):
+	mag_squared = blocks.complex_to_mag_squared(fft_size)
+	to_stream = blocks.vector_to_stream(gr.sizeof_float*1, fft_size)
+	const = analog.sig_source_f(0, analog.GR_CONST_WAVE, 0, 0, 1048580)
+	divide = blocks.divide_ff(1)
+	log = blocks.nlog10_ff(10, 1, 0)
+	average = blocks.moving_average_ff(1000, 0.001, 4000)
+	threshold = blocks.threshold_ff(-60, -60, -60)
+	keep = blocks.keep_one_in_n(gr.sizeof_float*1, fft_size)
+	tb.connect(src, mag_squared, to_stream, (divide, 0))
+	tb.connect(const, (divide, 1))
+	tb.connect(divide, log, average, keep, blocks.null_sink(gr.sizeof_float*1))
+	tb.connect(average, threshold, blocks.null_sink(gr.sizeof_float*1))
+
+# Level chain with the energy detector block
+def new_chain(tb, src):
+	detector = energy_detector(fft_size)
+	tb.connect(src, detector, blocks.null_sink(gr.sizeof_float*1))
+	tb.connect((detector, 1), blocks.null_sink(gr.sizeof_float*1))
+
+# Run a chain on the samples of the file (without throttle) and get the samples per second
+def run_chain(chain, filename):
+	tb = gr.top_block()
+	src = blocks.file_source(gr.sizeof_gr_complex*1, filename, True)
+	head = blocks.head(gr.sizeof_gr_complex*1, samples)
+	to_vector = blocks.stream_to_vector(gr.sizeof_gr_complex*1, fft_size)
+	fft_block = fft.fft_vcc(fft_size, True, (window.rectangular(fft_size)), True, 1)
+	tb.connect(src, head, to_vector, fft_block)
+	chain(tb, fft_block)
+
+	start = time.time()
+	tb.run()
+	return samples / (time.time() - start)
+
+# Main function
+if __name__ == '__main__':
+	# Setup the option parser
+	parser = OptionParser(description="Compare the throughput of the old level chain and the energy detector block")
+	parser.add_option("--input_file",
+		dest="input_file", type="string", default=input_file, help="The complex64 sample file, generated noise when not given")
+	parser.add_option("--samples",
+		dest="samples", type="int", default=samples, help="Amount of samples pushed trough the chains")
+	parser.add_option("--repeat",
+		dest="repeat", type="int", default=repeat, help="Amount of runs per chain, the fastest is used")
+
+	# Parse the options
+	(options, args) = parser.parse_args()
+	samples = options.samples
+
+	# Generate a noise file when there is no input
+	filename = options.input_file
+	if filename == None:
+		(fd, filename) = tempfile.mkstemp(suffix=".cfile")
+		os.close(fd)
+		noise = np.random.normal(0, 0.01, (generate_samples, 2)).astype(np.float32)
+		noise.tofile(filename)
+
+	try:
+		print "%-16s %10s" % ("chain", "MS/s")
+		rates = {}
+		for (name, chain) in [("old chain", old_chain), ("energy detector", new_chain)]:
+			rates[name] = max(run_chain(chain, filename) for i in range(options.repeat))
+			print "%-16s %10.2f" % (name, rates[name] / 1e6)
+		print "Speedup: %.2fx" % (rates["energy detector"] / rates["old chain"])
+	finally:
+		if options.input_file == None:
+			os.remove(filename)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python2
+from optparse import OptionParser
+import json
+import os
+import time
+import numpy as np
+from scipy.stats import norm
+import gen_graphs
+from gen_graphs import read_measurements, empirical_roc, calc_statistics
+
+# Variables
+input_files = ["results/detector.csv"]	# The prior sweeps of the DVB-T detector
+profile_dir = "profiles"		# The directory with a threshold profile per site
+target_fpr = None			# Target false alarm rate, the highest Youden's J is used when not given
+verbose = True				# Enable debugging information
+
+# Print debug information
+def print_debug(text):
+	if verbose:
+		print(text)
+
+# Get the profile file of a site
+def profile_file(site):
+	return os.path.join(profile_dir, site + ".json")
+
+# Store the profile of a site
+def save_profile(site, profile):
+	if not os.path.isdir(profile_dir):
+		os.makedirs(profile_dir)
+	with open(profile_file(site), 'w') as out_f:
+		json.dump(profile, out_f, indent=1, sort_keys=True)
+
+# Get the rates of a threshold with the rule of the detector, which detects the levels above the threshold
+def detection_rates(actual, measurement, threshold):
+	true_positive_rate = np.mean(measurement[actual] > threshold)
+	false_positive_rate = np.mean(measurement[~actual] > threshold)
+	return (false_positive_rate, true_positive_rate)
+
+# Choose the threshold of the measurements, with the highest Youden's J or for the target false alarm rate
+def calibrate(actual, measurement, target_fpr=None):
+	(false_positive_rate, true_positive_rate, thresholds) = empirical_roc(actual, measurement)
+	(neg_mean, neg_std, neg_grid, neg_pdf, neg_cdf) = calc_statistics(measurement[~actual])
+
+	# The threshold in between the best measured level and the next lower one, the detector detects above it (not
+	# rounded, the levels are only 0.01dB apart)
+	if target_fpr == None:
+		best = np.argmax(true_positive_rate - false_positive_rate)
+		lower = thresholds[best + 1] if best + 1 < len(thresholds) else thresholds[best] - 1
+		threshold = (thresholds[best] + lower) / 2 if np.isfinite(thresholds[best]) else lower + 1
+		method = "youden"
+
+	# The noise level which is exceeded with the target false alarm rate, by the normal distribution of the noise and
+	# by the lowest measured noise level with at most the target rate of noise above it (which can have a longer tail)
+	else:
+		negative = np.sort(measurement[~actual])
+		levels = np.unique(negative)
+		rates = (len(negative) - np.searchsorted(negative, levels, side='right')) / float(len(negative))
+		threshold = max(norm.isf(target_fpr, neg_mean, neg_std), levels[np.argmax(rates <= target_fpr)])
+		method = "fpr"
+
+	# The rates of the threshold on the measurements
+	(fpr, tpr) = detection_rates(actual, measurement, threshold)
+	return {
+		'threshold': float(threshold),
+		'method': method,
+		'target_fpr': target_fpr,
+		'true_positive_rate': float(tpr),
+		'false_positive_rate': float(fpr),
+		'youden_j': float(tpr - fpr),
+		'noise_mean': float(neg_mean),
+		'noise_std': float(neg_std),
+	}
+
+# Main function
+if __name__ == '__main__':
+	# Setup the option parser
+	parser = OptionParser(usage="usage: %prog [options] site [measurement files]",
+		description="Choose the detection threshold of a site from prior sweeps and store it in the site profile, " +
+			"which is loaded by dvbt_detector.py --site")
+	parser.add_option("-q",
+		dest="verbose", action="store_false", default=verbose, help="Disables debugging information (quiet mode)")
+	parser.add_option("--target_fpr",
+		dest="target_fpr", type="float", default=target_fpr, help="Target false alarm rate (the highest Youden's J when not given)")
+	parser.add_option("--channel_file",
+		dest="channel_file", type="string", default=None, help="The DVB-T channel table with a center frequency and optional width in MHz per line")
+	parser.add_option("--profile_dir",
+		dest="profile_dir", type="string", default=profile_dir, help="The directory of the site profiles")
+
+	# Parse the options
+	(options, args) = parser.parse_args()
+	if len(args) < 1:
+		parser.error("Expected a site")
+	if options.target_fpr != None and not 0 < options.target_fpr < 1:
+		parser.error("The target false alarm rate must be between 0 and 1")
+	verbose = options.verbose
+	profile_dir = options.profile_dir
+	gen_graphs.channel_file = options.channel_file
+	site = args[0]
+	filenames = args[1:] or input_files
+
+	# Calibrate on the measurements of all sweeps together
+	measurements = [read_measurements(filename) for filename in filenames]
+	actual = np.concatenate([m[0] for m in measurements])
+	measurement = np.concatenate([m[1] for m in measurements])
+	print_debug("Read %d measurements (%d DVB-T) of %d sweeps" % (len(actual), np.sum(actual), len(filenames)))
+
+	profile = calibrate(actual, measurement, options.target_fpr)
+	profile.update({'site': site, 'files': filenames, 'created': time.strftime("%Y-%m-%d %H:%M:%S")})
+	save_profile(site, profile)
+	print("Threshold of %s: %.2fdB (true positive rate %.3f, false positive rate %.3f, J = %.2f), stored in %s" % (
+		site, profile['threshold'], profile['true_positive_rate'], profile['false_positive_rate'], profile['youden_j'],
+		profile_file(site)))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+##################################################
+# Custom blocks of the DVBT scanner flowgraphs
+##################################################
+
+from gnuradio import gr
+import numpy
+import pmt
+import threading
+import time
+
+
+class level_sink(gr.sync_block):
+    """
+    Sink of the level estimates (one per FFT) which knows the frequency they were measured at.
+
+    Every retune remembers the sample count of the sink, and only the estimates after it (and after the skipped
+    estimates of samples still buffered from the previous frequency) are kept for the new frequency. The latest
+    estimate is published as a message with the frequency, detection, sample count and timestamp on the level port.
+    """
+
+    def __init__(self, threshold=-60, skip=256, freq=None, max_levels=100000):
+        gr.sync_block.__init__(self, name="level_sink", in_sig=[numpy.float32], out_sig=None)
+        self.message_port_register_out(pmt.intern("level"))
+        self.threshold = threshold
+        self.skip = skip
+        self.max_levels = max_levels
+        self.cond = threading.Condition()
+
+        # The current frequency with the first estimate measured at it, and its estimates
+        self.freq = freq
+        self.first_item = skip
+        self.levels = []
+        self.measurement = None
+
+    def work(self, input_items, output_items):
+        levels = input_items[0]
+        start = self.nitems_read(0)
+        now = time.time()
+        with self.cond:
+            new = levels[max(0, self.first_item - start):]
+            if len(new) > 0:
+                self.levels.extend(new.tolist())
+                del self.levels[:-self.max_levels]
+                level = float(new[-1])
+                self.measurement = {"freq": self.freq, "level": level, "detected": int(level > self.threshold),
+                                    "item": start + len(levels) - 1, "time": now}
+                self.cond.notify_all()
+            measurement = self.measurement if len(new) > 0 else None
+
+        if measurement != None:
+            self.message_port_pub(pmt.intern("level"), pmt.to_pmt(measurement))
+        return len(levels)
+
+    # Start measuring at a new frequency, the estimates of the previous one are dropped
+    def retune(self, freq):
+        with self.cond:
+            self.freq = freq
+            self.first_item = self.nitems_read(0) + self.skip
+            self.levels = []
+            self.measurement = None
+
+    def set_threshold(self, threshold):
+        self.threshold = threshold
+
+    def set_skip(self, skip):
+        self.skip = skip
+
+    # Wait until there are count estimates at the current frequency (or the timeout in seconds passed) and get them
+    def wait_levels(self, count=1, timeout=None):
+        deadline = time.time() + timeout if timeout != None else None
+        with self.cond:
+            while len(self.levels) < count and (deadline == None or time.time() < deadline):
+                self.cond.wait(deadline - time.time() if deadline != None else None)
+            return list(self.levels)
+
+    # The latest measurement at the current frequency (None right after a retune)
+    def get_measurement(self):
+        with self.cond:
+            return self.measurement
+
+
+class energy_detector(gr.sync_block):
+    """
+    Energy detector on FFT vectors, replacing the complex_to_mag_squared, divide, nlog10 and moving average chain.
+
+    Every vector gives the mean power in dB of its bins (with the same scale as the old chain), averaged over the
+    last length vectors, and the detection decision (1 above the threshold) on the second output.
+    """
+
+    def __init__(self, fft_size=1024, length=1, threshold=-60, scale=1048580):
+        gr.sync_block.__init__(self, name="energy_detector", in_sig=[(numpy.complex64, fft_size)],
+                               out_sig=[numpy.float32, numpy.float32])
+        self.fft_size = fft_size
+        self.threshold = threshold
+        self.scale = scale
+        self.set_length(length)
+
+    def work(self, input_items, output_items):
+        vectors = input_items[0]
+        power = vectors.real**2 + vectors.imag**2
+        levels = numpy.mean(10 * numpy.log10(power / self.scale + 1e-20), axis=1)
+
+        # Moving average over the vectors, continuing from the last ones of the previous call
+        levels = numpy.concatenate((self.history, levels))
+        sums = numpy.cumsum(levels)
+        sums[self.length:] -= sums[:-self.length].copy()
+        counts = numpy.minimum(numpy.arange(1, len(levels) + 1), self.length)
+        average = (sums / counts)[len(self.history):]
+        self.history = levels[max(0, len(levels) - self.length + 1):] if self.length > 1 else levels[:0]
+
+        output_items[0][:] = average
+        output_items[1][:] = average > self.threshold
+        return len(vectors)
+
+    def set_length(self, length):
+        self.length = max(1, int(length))
+        self.history = numpy.zeros(0)
+
+    def set_threshold(self, threshold):
+        self.threshold = threshold
+
+
+class spectrum_sink(gr.sync_block):
+    """
+    Sink of the FFT vectors which keeps the mean level in dB of every bin since the last retune.
+
+    Only the running sum of the levels is kept instead of the vectors, so it uses the same memory however long it
+    runs. Like the level sink, the vectors of the skipped samples after a retune are left out.
+    """
+
+    def __init__(self, fft_size=1024, skip=256, scale=1048580):
+        gr.sync_block.__init__(self, name="spectrum_sink", in_sig=[(numpy.complex64, fft_size)], out_sig=None)
+        self.fft_size = fft_size
+        self.skip = skip
+        self.scale = scale
+        self.cond = threading.Condition()
+
+        # The sum of the levels of every bin since the first vector measured at the current frequency
+        self.first_item = skip
+        self.sums = numpy.zeros(fft_size)
+        self.count = 0
+
+    def work(self, input_items, output_items):
+        vectors = input_items[0]
+        start = self.nitems_read(0)
+        with self.cond:
+            new = vectors[max(0, self.first_item - start):]
+            if len(new) > 0:
+                power = new.real**2 + new.imag**2
+                self.sums += numpy.sum(10 * numpy.log10(power / self.scale + 1e-20), axis=0)
+                self.count += len(new)
+                self.cond.notify_all()
+        return len(vectors)
+
+    # Start measuring at a new frequency, the levels of the previous one are dropped
+    def retune(self):
+        with self.cond:
+            self.first_item = self.nitems_read(0) + self.skip
+            self.sums = numpy.zeros(self.fft_size)
+            self.count = 0
+
+    def set_skip(self, skip):
+        self.skip = skip
+
+    # Wait until count vectors were measured at the current frequency (or the timeout in seconds passed) and get the
+    # mean level of every bin (None without any vector)
+    def wait_spectrum(self, count=1, timeout=None):
+        deadline = time.time() + timeout if timeout != None else None
+        with self.cond:
+            while self.count < count and (deadline == None or time.time() < deadline):
+                self.cond.wait(deadline - time.time() if deadline != None else None)
+            return self.sums / self.count if self.count > 0 else None
@@ -1,78 +1,246 @@
 #!/usr/bin/env python2
 from optparse import OptionParser
-from dvbt_scanner import dvbt_scanner
+import json
+import os
 import thread
+import threading
 import time
+import traceback
+import numpy as np
 
 # Variables
 freq_min = 480		# Frequency minimum in MHz
 freq_max = 800  	# Frequency maximum in MHz
 freq_step = 0.5		# Frequency steps in MHz
-threshold = -77		# Detection threshold level in dB
-wait_time = 4		# Wait time in seconds between frequency change
+threshold = -77		# Detection threshold level in dB (when there is no site profile)
+site = None		# The site whose calibrated threshold profile is loaded (see calibrate.py)
+profile_dir = "profiles"	# The directory with a threshold profile per site
+wait_time = 4		# Maximum wait time in seconds for the level to settle after a frequency change
+settle_samples = 262144	# Samples after a retune which are skipped (the buffered samples and the moving average)
+settle_levels = 20	# Amount of level estimates (one per FFT) checked for convergence
+settle_tolerance = 0.05	# Maximum standard error in dB of the mean of the checked level estimates
 output_file = "results/detector.csv"	# The output file for the results
 verbose = True 		# Show debugging information
+headless = False	# Run the scanner without GUI
+source = "osmosdr"	# The sample source of the headless scanner (osmosdr, file, signal or replay)
+input_file = None	# The complex64 sample file for the file source
+devices = ["hackrf=0"]	# The osmosdr device arguments of every SDR, the range is split over the devices
+record_dir = None	# The directory to record the samples of every center frequency to
+replay_rate = 20.48e6	# Sample rate of a replayed wideband recording (a multiple of the 2.048MS/s of the scanner)
+replay_center = 640	# Center frequency in MHz of a replayed wideband recording
+wideband = False	# Detect per frequency bin from the full FFT instead of one level per retune
+usable_bw = 1.75	# Bandwidth in MHz around the center frequency used in wideband mode (also the retune step)
+dc_bins = 2		# FFT bins on both sides of the center (DC offset) which are left out in wideband mode
+spectrum_file = None	# The output file for the stitched spectrum in wideband mode
 
 # Print debug information
 def print_debug(text):
 	if verbose:
 		print(text)
 
-# Main detector
-def detector(scanner):
-	# Output debug information
-	est_time = (freq_max - freq_min) / freq_step * wait_time / 60;
-	print_debug("")
-	print_debug("=====================================================================================")
-	print_debug("Starting detector with %.2fdB threshold from %.2fMHz to %.2fMHz (with step %.2fMHz)." % (threshold, freq_min, freq_max, freq_step))
-	print_debug("Estimated time is %.2f minutes (based on wait time of %d seconds)" % (est_time, wait_time))
-	print_debug("=====================================================================================")
-	print_debug("")
+# Wait until the signal level settled after a retune, returns the level and the settle time. The scanner only reports
+# level estimates measured at the current frequency (after the skipped settle samples), so a level of the previous
+# frequency is never used
+def settle(scanner):
+	start = time.time()
+	levels = []
+	while True:
+		# Use whatever we have when it didn't converge within the wait time, but at least one estimate
+		remaining = wait_time - (time.time() - start)
+		if remaining <= 0:
+			levels = scanner.wait_levels(1)
+			return (np.mean(levels[-settle_levels:]), time.time() - start)
 
-	# Open the output file
-	f = open(output_file, "w")
+		# Stop when the mean of the last level estimates is accurate enough, every estimate itself varies by about
+		# 0.18dB on noise (a mean over the FFT bins), so it is their standard error which converges
+		levels = scanner.wait_levels(max(len(levels) + 1, settle_levels), remaining)
+		if len(levels) >= settle_levels and np.std(levels[-settle_levels:]) / np.sqrt(settle_levels) < settle_tolerance:
+			return (np.mean(levels[-settle_levels:]), time.time() - start)
 
-	# Set the detection level
-	scanner.set_threshold(threshold)
+# Get the average level of the usable FFT bins after the scanner settled, with their frequencies in MHz
+def measure_spectrum(scanner, freq):
+	fft_size = scanner.get_fft_size()
+	levels = scanner.get_spectrum()
 
-	# Go trough the frequencies
-	for freq in range(int(freq_min*1e6), int(freq_max*1e6), int(freq_step*1e6)):
+	# Only keep the bins within the usable bandwidth, without the DC offset
+	bin_width = scanner.get_samp_rate() / 1e6 / fft_size
+	offsets = (np.arange(fft_size) - fft_size // 2) * bin_width
+	usable = (-usable_bw/2 <= offsets) & (offsets < usable_bw/2) & (np.abs(np.arange(fft_size) - fft_size // 2) > dc_bins)
+	return (freq / 1e6 + offsets[usable], levels[usable])
+
+# Split the frequency range in frequency steps over count scanners, returns the (minimum, maximum) range per scanner
+def split_range(count):
+	steps = int(np.ceil((freq_max - freq_min) / freq_step - 1e-9))
+	per_scanner = int(np.ceil(steps / float(count)))
+	ranges = []
+	for i in range(0, steps, per_scanner):
+		ranges.append((freq_min + i * freq_step, min(freq_max, freq_min + (i + per_scanner) * freq_step)))
+	return ranges
+
+# Sweep in frequency steps and detect on the level of every step, returns the amount of retunes
+def sweep(scanner, f, spec_f, f_min, f_max):
+	steps = 0
+	for freq in range(int(round(f_min*1e6)), int(round(f_max*1e6)), int(round(freq_step*1e6))):
 		# Set the frequency
 		scanner.set_freq(freq)
 
-		# Wait for some time
-		time.sleep(wait_time)
+		# Wait until the level settled
+		(signal_level, settle_time) = settle(scanner)
+		steps += 1
 
 		# Do the measurement
 		freq_mhz = freq / 1e6
-		signal_level = scanner.get_signal_level()
-		detected = scanner.get_detected()
+		detected = int(signal_level > threshold)
 		f.write("%.2f,%.2f,%.2f,%d\n" % (freq_mhz, threshold, signal_level, detected))
+		f.flush()
 
 		# Print debug information
-		print_debug("Freq: %.2fMHz, Signal level: %.2fdB, Detected %d" % (freq_mhz, signal_level, detected))
+		print_debug("Freq: %.2fMHz, Signal level: %.2fdB, Detected %d, Settle time: %.3fs" % (freq_mhz, signal_level, detected, settle_time))
+	return steps
+
+# Write the level of the frequency steps from start up to stop which got any bins, returns stop
+def write_steps(f, centers, sums, counts, start, stop):
+	for i in range(start, stop):
+		if counts[i]:
+			signal_level = sums[i] / counts[i]
+			detected = int(signal_level > threshold)
+			f.write("%.2f,%.2f,%.2f,%d\n" % (centers[i], threshold, signal_level, detected))
+			print_debug("Freq: %.2fMHz, Signal level: %.2fdB, Detected %d" % (centers[i], signal_level, detected))
+	f.flush()
+	return stop
+
+# Sweep in steps of the usable bandwidth, stitch the spectra and detect per frequency step, returns the amount of retunes
+def wideband_sweep(scanner, f, spec_f, f_min, f_max):
+	# The frequency steps are centered on the frequencies of a narrowband sweep
+	centers = f_min + freq_step * np.arange(int(np.ceil((f_max - f_min) / freq_step - 1e-9)))
+	low = f_min - freq_step / 2
+	high = low + len(centers) * freq_step
+
+	sums = np.zeros(len(centers))
+	counts = np.zeros(len(centers), dtype=int)
+	written = 0
+	steps = 0
+	for freq in np.arange(low + usable_bw/2, high + usable_bw/2, usable_bw):
+		scanner.set_freq(int(freq*1e6))
+		(signal_level, settle_time) = settle(scanner)
+		(freqs, levels) = measure_spectrum(scanner, freq*1e6)
+		steps += 1
+		print_debug("Center freq: %.2fMHz, Signal level: %.2fdB, Settle time: %.3fs" % (freq, signal_level, settle_time))
+
+		# Only keep the bins within the range, the last retune can go past it
+		in_range = (low <= freqs) & (freqs < high)
+		freqs = freqs[in_range]
+		levels = levels[in_range]
+
+		# Write the stitched spectrum
+		if spec_f:
+			for (freq_mhz, level) in zip(freqs, levels):
+				spec_f.write("%.4f,%.2f\n" % (freq_mhz, level))
+			spec_f.flush()
 
-	# Close the output file
+		# Average the bins within every frequency step (the same output as a narrowband sweep)
+		idx = np.floor((freqs - low) / freq_step).astype(int)
+		valid = (0 <= idx) & (idx < len(centers))
+		counts += np.bincount(idx[valid], minlength=len(centers))
+		sums += np.bincount(idx[valid], weights=levels[valid], minlength=len(centers))
+
+		# The later retunes are all above this one, so the frequency steps below its upper edge are written right away
+		# (for the live analyzer)
+		complete = int(np.floor((freq + usable_bw/2 - low) / freq_step + 1e-9))
+		written = write_steps(f, centers, sums, counts, written, max(written, min(complete, len(centers))))
+	write_steps(f, centers, sums, counts, written, len(centers))
+	return steps
+
+# A file shared by the threads of the scanners, every write and flush is done as a whole
+class SharedFile:
+	def __init__(self, f):
+		self.f = f
+		self.lock = threading.Lock()
+
+	def write(self, text):
+		with self.lock:
+			self.f.write(text)
+
+	def flush(self):
+		with self.lock:
+			self.f.flush()
+
+# Sweep the range of every scanner in its own thread, the results are written as they are measured (so they are in
+# the order of measurement instead of frequency), returns the amount of retunes
+def parallel_sweep(scanners, f, spec_f):
+	run_sweep = wideband_sweep if wideband else sweep
+	shared_f = SharedFile(f)
+	shared_spec_f = SharedFile(spec_f) if spec_f else None
+	results = []
+	threads = []
+	for (scanner, (f_min, f_max)) in zip(scanners, split_range(len(scanners))):
+		result = [0, None]
+		results.append(result)
+
+		# An error only stops the thread of its scanner, so it is kept to raise it after all threads finished
+		def run(scanner=scanner, result=result, f_min=f_min, f_max=f_max):
+			try:
+				result[0] = run_sweep(scanner, shared_f, shared_spec_f, f_min, f_max)
+			except Exception as e:
+				traceback.print_exc()
+				result[1] = e
+		threads.append(threading.Thread(target=run))
+		threads[-1].start()
+
+	for t in threads:
+		t.join()
+
+	# The range of a failed scanner would silently be missing from the results
+	for result in results:
+		if result[1] != None:
+			raise result[1]
+	return sum(result[0] for result in results)
+
+# Main detector
+def detector(scanners):
+	# Output debug information
+	est_time = (freq_max - freq_min) / (usable_bw if wideband else freq_step) * wait_time / 60 / len(scanners);
+	print_debug("")
+	print_debug("=====================================================================================")
+	print_debug("Starting detector with %.2fdB threshold from %.2fMHz to %.2fMHz (with step %.2fMHz) on %d scanner(s)." % (threshold, freq_min, freq_max, freq_step, len(scanners)))
+	print_debug("Estimated time is at most %.2f minutes (based on wait time of %d seconds)" % (est_time, wait_time))
+	print_debug("=====================================================================================")
+	print_debug("")
+
+	# Open the output files
+	f = open(output_file, "w")
+	spec_f = open(spectrum_file, "w") if wideband and spectrum_file else None
+
+	# Set the detection level and the samples skipped after a retune
+	for scanner in scanners:
+		scanner.set_threshold(threshold)
+		scanner.set_settle_samples(settle_samples)
+
+	# Go trough the frequencies
+	sweep_start = time.time()
+	if len(scanners) > 1:
+		steps = parallel_sweep(scanners, f, spec_f)
+	elif wideband:
+		steps = wideband_sweep(scanners[0], f, spec_f, freq_min, freq_max)
+	else:
+		steps = sweep(scanners[0], f, spec_f, freq_min, freq_max)
+
+	# Close the output files
 	f.close()
+	if spec_f:
+		spec_f.close()
 
 	# Output debug information
+	sweep_time = time.time() - sweep_start
 	print_debug("")
 	print_debug("=====================================================================================")
-	print_debug("FINISHED")
+	print_debug("FINISHED in %.2f minutes (%d retunes, %.3f seconds per retune)" % (sweep_time / 60, steps, sweep_time / max(steps, 1)))
 	print_debug("=====================================================================================")
 	print_debug("")
 
 # Main function
 if __name__ == '__main__':
-	# Make sure GNURadio works
-	import ctypes
 	import sys
-	if sys.platform.startswith('linux'):
-		try:
-			x11 = ctypes.cdll.LoadLibrary('libX11.so')
-			x11.XInitThreads()
-		except:
-			print "Warning: failed to XInitThreads()"
 
 	# Setup the option parser
 	parser = OptionParser()
@@ -85,11 +253,37 @@ if __name__ == '__main__':
 	parser.add_option("--freq_step",
 		dest="freq_step", type="float", default=freq_step, help="The frequency steps to take while searching in MHz")
 	parser.add_option("--threshold",
-		dest="threshold", type="float", default=threshold, help="Threshold in dB used for the detector")
+		dest="threshold", type="float", default=None, help="Threshold in dB used for the detector (default from the site profile, or %.2f)" % threshold)
+	parser.add_option("--site",
+		dest="site", type="string", default=site, help="Load the calibrated threshold from the profile of this site (see calibrate.py)")
+	parser.add_option("--profile_dir",
+		dest="profile_dir", type="string", default=profile_dir, help="The directory of the site profiles")
 	parser.add_option("--wait_time",
-		dest="wait_time", type="float", default=wait_time, help="Amount of time to wait between fequency steps in seconds")
+		dest="wait_time", type="float", default=wait_time, help="Maximum amount of time to wait for the level to settle after a frequency step in seconds")
+	parser.add_option("--settle_tolerance",
+		dest="settle_tolerance", type="float", default=settle_tolerance, help="Maximum standard error in dB of the mean of the level estimates to be settled")
 	parser.add_option("-o", "--output_file",
 		dest="output_file", type="string", default=output_file, help="The output file for the CSV data")
+	parser.add_option("--headless",
+		dest="headless", action="store_true", default=headless, help="Run the scanner without GUI (no X server needed)")
+	parser.add_option("--source",
+		dest="source", type="choice", choices=["osmosdr", "file", "signal", "replay"], default=source, help="The sample source of the headless scanner (osmosdr, file, signal or replay)")
+	parser.add_option("--input_file",
+		dest="input_files", type="string", action="append", help="The complex64 sample file for the file source, or the recording directory or wideband file for the replay source (repeat for one per device)")
+	parser.add_option("--device",
+		dest="devices", type="string", action="append", help="The osmosdr device arguments of an SDR (repeat for parallel SDRs, default %s)" % devices[0])
+	parser.add_option("--record_dir",
+		dest="record_dir", type="string", default=record_dir, help="Record the samples of every center frequency to a file in this directory (needs --headless)")
+	parser.add_option("--replay_rate",
+		dest="replay_rate", type="float", default=replay_rate, help="The sample rate of a replayed wideband recording (a multiple of the 2.048MS/s of the scanner)")
+	parser.add_option("--replay_center",
+		dest="replay_center", type="float", default=replay_center, help="The center frequency in MHz of a replayed wideband recording")
+	parser.add_option("--wideband",
+		dest="wideband", action="store_true", default=wideband, help="Detect per frequency step from the full FFT, retuning by the usable bandwidth (needs --headless)")
+	parser.add_option("--usable_bw",
+		dest="usable_bw", type="float", default=usable_bw, help="The usable bandwidth around the center frequency in MHz for the wideband mode")
+	parser.add_option("--spectrum_file",
+		dest="spectrum_file", type="string", default=spectrum_file, help="The output file for the stitched spectrum in wideband mode")
 
 	# Parse the options
 	(options, args) = parser.parse_args()
@@ -97,16 +291,75 @@ if __name__ == '__main__':
 	freq_min = options.freq_min
 	freq_max = options.freq_max
 	freq_step = options.freq_step
-	threshold = options.threshold
+	profile_dir = options.profile_dir
+	# An explicit threshold goes before the calibrated one of the site
+	if options.threshold != None:
+		threshold = options.threshold
+	elif options.site:
+		profile_file = os.path.join(profile_dir, options.site + ".json")
+		if not os.path.exists(profile_file):
+			parser.error("No profile of site %s, run calibrate.py first" % options.site)
+		with open(profile_file) as in_f:
+			threshold = json.load(in_f)['threshold']
+		print_debug("Loaded the threshold of site %s: %.2fdB" % (options.site, threshold))
 	wait_time = options.wait_time
+	settle_tolerance = options.settle_tolerance
+	wideband = options.wideband
+	usable_bw = options.usable_bw
+	spectrum_file = options.spectrum_file
+	if wideband and not options.headless:
+		parser.error("The wideband mode needs --headless")
 	output_file = options.output_file
 
+	devices = options.devices or devices
+	input_files = options.input_files or [input_file]
+	if not options.headless and (len(devices) > 1 or len(input_files) > 1):
+		parser.error("Parallel scanners need --headless")
+	if options.record_dir and not options.headless:
+		parser.error("Recording needs --headless")
+	if options.record_dir and not os.path.isdir(options.record_dir):
+		os.makedirs(options.record_dir)
+
+	# Run a headless scanner per device (or per file standing in for a device) and the detector until the sweep is done
+	if options.headless:
+		if options.source in ["file", "replay"] and input_files[0] == None:
+			parser.error("The %s source needs an input file" % options.source)
+
+		from dvbt_headless import dvbt_headless
+		if options.source in ["file", "replay"]:
+			scanners = [dvbt_headless(options.source, filename, record_dir=options.record_dir,
+				replay_rate=options.replay_rate, replay_center=options.replay_center*1e6, spectrum=wideband) for filename in input_files]
+		elif options.source == "osmosdr":
+			scanners = [dvbt_headless(options.source, device=device, record_dir=options.record_dir, spectrum=wideband) for device in devices]
+		else:
+			scanners = [dvbt_headless(options.source, record_dir=options.record_dir, spectrum=wideband)]
+		for scanner in scanners:
+			scanner.start()
+		try:
+			detector(scanners)
+		finally:
+			for scanner in scanners:
+				scanner.stop_recording()
+				scanner.stop()
+				scanner.wait()
+		sys.exit(0)
+
+	# Make sure GNURadio works
+	import ctypes
+	if sys.platform.startswith('linux'):
+		try:
+			x11 = ctypes.cdll.LoadLibrary('libX11.so')
+			x11.XInitThreads()
+		except:
+			print "Warning: failed to XInitThreads()"
+
 	# Start the scanner
+	from dvbt_scanner import dvbt_scanner
 	scanner = dvbt_scanner()
 	scanner.Start(True)
 
 	# Start the detector
-	thread.start_new_thread(detector, (scanner,))
+	thread.start_new_thread(detector, ([scanner],))
 
 	# Wait for the scanner to close
 	scanner.Wait()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+##################################################
+# GNU Radio Python Flow Graph
+# Title: DVBT Scanner (headless)
+# Description: The chain of dvbt_scanner.py without any GUI, for unattended sweeps
+##################################################
+
+from gnuradio import analog
+from gnuradio import blocks
+from gnuradio import fft
+from gnuradio import filter
+from gnuradio import gr
+from gnuradio.fft import window
+from gnuradio.filter import firdes
+from dvbt_blocks import energy_detector, level_sink, spectrum_sink
+from optparse import OptionParser
+import glob
+import os
+import time
+
+# Available sample sources
+sources = ["osmosdr", "file", "signal", "replay"]
+
+
+# The recording of a center frequency (in Hz) in a recording directory
+def recording_file(directory, freq):
+    return os.path.join(directory, "%d.cfile" % freq)
+
+
+class dvbt_headless(gr.top_block):
+
+    def __init__(self, source="osmosdr", input_file=None, samp_rate=2048000, fft_size=1024, settle_samples=262144, integration=1, device="hackrf=0", record_dir=None, replay_rate=None, replay_center=None, spectrum=False):
+        gr.top_block.__init__(self, "DVBT Scanner (headless)")
+
+        ##################################################
+        # Variables
+        ##################################################
+        self.threshold = threshold = -60
+        self.samp_rate = samp_rate
+        self.freq = freq = 525200000
+        self.fft_size = fft_size
+        self.settle_samples = settle_samples
+        self.integration = integration
+        self.source = source
+        self.record_dir = record_dir
+        self.replay_center = replay_center
+        self.spectrum = spectrum
+
+        ##################################################
+        # Blocks
+        ##################################################
+        if source == "osmosdr":
+            import osmosdr
+            self.rtlsdr_source_0 = osmosdr.source( args="numchan=" + str(1) + " " + device )
+            self.rtlsdr_source_0.set_sample_rate(samp_rate)
+            self.rtlsdr_source_0.set_center_freq(freq, 0)
+            self.rtlsdr_source_0.set_freq_corr(0, 0)
+            self.rtlsdr_source_0.set_dc_offset_mode(0, 0)
+            self.rtlsdr_source_0.set_iq_balance_mode(0, 0)
+            self.rtlsdr_source_0.set_gain_mode(False, 0)
+            self.rtlsdr_source_0.set_gain(14, 0)
+            self.rtlsdr_source_0.set_if_gain(24, 0)
+            self.rtlsdr_source_0.set_bb_gain(12, 0)
+            self.rtlsdr_source_0.set_antenna("", 0)
+            self.rtlsdr_source_0.set_bandwidth(0, 0)
+            self.source_0 = self.rtlsdr_source_0
+        elif source == "replay":
+            # Recordings are replayed without throttle, a directory has a file per center frequency, and a single
+            # wideband file (of replay_rate around replay_center) is shifted and decimated to the center frequency
+            if os.path.isdir(input_file):
+                recordings = sorted(glob.glob(os.path.join(input_file, "*.cfile")))
+                if not recordings:
+                    raise ValueError("No recordings in %s" % input_file)
+                self.blocks_file_source_0 = blocks.file_source(gr.sizeof_gr_complex*1, recordings[0], True)
+                self.source_0 = self.blocks_file_source_0
+            else:
+                # Only whole decimations, otherwise the spectrum would be scaled compared to the bin frequencies
+                if replay_rate % samp_rate != 0:
+                    raise ValueError("The replay rate of %gMS/s is not a multiple of the sample rate of %gMS/s" % (replay_rate / 1e6, samp_rate / 1e6))
+                decimation = int(replay_rate // samp_rate)
+                self.blocks_file_source_0 = blocks.file_source(gr.sizeof_gr_complex*1, input_file, True)
+                self.freq_xlating_fir_filter_xxx_0 = filter.freq_xlating_fir_filter_ccc(decimation, (firdes.low_pass(1, replay_rate, 0.45 * samp_rate, 0.1 * samp_rate)), freq - replay_center, replay_rate)
+                self.connect((self.blocks_file_source_0, 0), (self.freq_xlating_fir_filter_xxx_0, 0))
+                self.source_0 = self.freq_xlating_fir_filter_xxx_0
+            self.replay_dir = input_file if os.path.isdir(input_file) else None
+        else:
+            # File and signal sources are throttled to the sample rate, so the wait times stay the same
+            if source == "file":
+                self.blocks_file_source_0 = blocks.file_source(gr.sizeof_gr_complex*1, input_file, True)
+                src = self.blocks_file_source_0
+            else:
+                self.analog_sig_source_x_0 = analog.sig_source_c(samp_rate, analog.GR_COS_WAVE, 100000, 0.001, 0)
+                self.analog_noise_source_x_0 = analog.noise_source_c(analog.GR_GAUSSIAN, 0.0001, 0)
+                self.blocks_add_xx_0 = blocks.add_vcc(1)
+                self.connect((self.analog_sig_source_x_0, 0), (self.blocks_add_xx_0, 0))
+                self.connect((self.analog_noise_source_x_0, 0), (self.blocks_add_xx_0, 1))
+                src = self.blocks_add_xx_0
+            self.blocks_throttle_0 = blocks.throttle(gr.sizeof_gr_complex*1, samp_rate, True)
+            self.connect((src, 0), (self.blocks_throttle_0, 0))
+            self.source_0 = self.blocks_throttle_0
+
+        self.level_sink_0 = level_sink(threshold, settle_samples // fft_size, freq)
+        self.energy_detector_0 = energy_detector(fft_size, integration, threshold)
+        self.blocks_null_sink_0 = blocks.null_sink(gr.sizeof_float*1)
+        self.fft_vxx_0 = fft.fft_vcc(fft_size, True, (window.rectangular(fft_size)), True, 1)
+        self.blocks_stream_to_vector_0 = blocks.stream_to_vector(gr.sizeof_gr_complex*1, fft_size)
+
+        ##################################################
+        # Connections
+        ##################################################
+        self.connect((self.blocks_stream_to_vector_0, 0), (self.fft_vxx_0, 0))
+        self.connect((self.energy_detector_0, 0), (self.level_sink_0, 0))
+        self.connect((self.energy_detector_0, 1), (self.blocks_null_sink_0, 0))
+        self.connect((self.fft_vxx_0, 0), (self.energy_detector_0, 0))
+        self.connect((self.source_0, 0), (self.blocks_stream_to_vector_0, 0))
+
+        # The mean level of every FFT bin is only kept for the wideband mode
+        if spectrum:
+            self.spectrum_sink_0 = spectrum_sink(fft_size, settle_samples // fft_size)
+            self.connect((self.fft_vxx_0, 0), (self.spectrum_sink_0, 0))
+
+        # The samples of every center frequency are recorded to a file per frequency, which can be replayed
+        if record_dir:
+            self.blocks_file_sink_0 = blocks.file_sink(gr.sizeof_gr_complex*1, os.devnull, False)
+            self.connect((self.source_0, 0), (self.blocks_file_sink_0, 0))
+
+    def get_threshold(self):
+        return self.threshold
+
+    def set_threshold(self, threshold):
+        self.threshold = threshold
+        self.energy_detector_0.set_threshold(self.threshold)
+        self.level_sink_0.set_threshold(self.threshold)
+
+    # The latest measurement at the current frequency, nothing is reported until the skipped samples passed
+    def get_measurement(self):
+        return self.level_sink_0.get_measurement()
+
+    def get_signal_level(self):
+        measurement = self.get_measurement()
+        return measurement["level"] if measurement else None
+
+    def get_detected(self):
+        measurement = self.get_measurement()
+        return measurement["detected"] if measurement else None
+
+    # Level estimates (one per FFT) at the current frequency, used to wait until the level settled after a retune
+    def wait_levels(self, count=1, timeout=None):
+        return self.level_sink_0.wait_levels(count, timeout)
+
+    def get_settle_samples(self):
+        return self.settle_samples
+
+    def set_settle_samples(self, settle_samples):
+        self.settle_samples = settle_samples
+        self.level_sink_0.set_skip(self.settle_samples // self.fft_size)
+        if self.spectrum:
+            self.spectrum_sink_0.set_skip(self.settle_samples // self.fft_size)
+
+    # Mean level of the FFT bins (centered around the frequency) since the retune and the skipped samples, with the
+    # same scale as the levels (waits for the first FFT vector, only with the spectrum enabled)
+    def get_spectrum(self):
+        return self.spectrum_sink_0.wait_spectrum(1)
+
+    def get_samp_rate(self):
+        return self.samp_rate
+
+    def get_freq(self):
+        return self.freq
+
+    # The file and signal sources stay the same on every frequency, a replay switches to the recording of the
+    # frequency. The measurements and spectra from before the retune are dropped
+    def set_freq(self, freq):
+        self.freq = freq
+        if self.source == "osmosdr":
+            self.rtlsdr_source_0.set_center_freq(self.freq, 0)
+        elif self.source == "replay" and self.replay_dir:
+            recording = recording_file(self.replay_dir, self.freq)
+            if not os.path.exists(recording):
+                raise ValueError("No recording of %.2fMHz in %s" % (self.freq / 1e6, self.replay_dir))
+            self.blocks_file_source_0.open(recording, True)
+        elif self.source == "replay":
+            self.freq_xlating_fir_filter_xxx_0.set_center_freq(self.freq - self.replay_center)
+        if self.record_dir:
+            self.blocks_file_sink_0.open(recording_file(self.record_dir, self.freq))
+        self.level_sink_0.retune(self.freq)
+        if self.spectrum:
+            self.spectrum_sink_0.retune()
+
+    def get_fft_size(self):
+        return self.fft_size
+
+    # Stop recording (the last recording is closed)
+    def stop_recording(self):
+        if self.record_dir:
+            self.blocks_file_sink_0.close()
+
+    # Amount of FFT vectors the level is averaged over
+    def get_integration(self):
+        return self.integration
+
+    def set_integration(self, integration):
+        self.integration = integration
+        self.energy_detector_0.set_length(self.integration)
+
+
+def main(top_block_cls=dvbt_headless, options=None):
+    parser = OptionParser()
+    parser.add_option("--source",
+        dest="source", type="choice", choices=sources, default="osmosdr", help="The sample source: " + ", ".join(sources))
+    parser.add_option("--input_file",
+        dest="input_file", type="string", default=None, help="The complex64 sample file for the file source, or the recording directory or wideband file for the replay source")
+    parser.add_option("--device",
+        dest="device", type="string", default="hackrf=0", help="The osmosdr device arguments")
+    (options, args) = parser.parse_args()
+
+    tb = top_block_cls(options.source, options.input_file, device=options.device)
+    tb.start()
+    try:
+        while True:
+            tb.wait_levels(1)
+            measurement = tb.get_measurement()
+            print "Freq: %.2fMHz, Signal level: %.2fdB, Detected %d" % (measurement["freq"] / 1e6, measurement["level"], measurement["detected"])
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    tb.stop()
+    tb.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -18,7 +18,7 @@ if __name__ == '__main__':
         except:
             print "Warning: failed to XInitThreads()"
 
-from gnuradio import analog
+from dvbt_blocks import energy_detector, level_sink
 from gnuradio import blocks
 from gnuradio import eng_notation
 from gnuradio import fft
@@ -33,8 +33,6 @@ from gnuradio.wxgui import numbersink2
 from grc_gnuradio import wxgui as grc_wxgui
 from optparse import OptionParser
 import osmosdr
-import threading
-import time
 import wx
 
 
@@ -47,11 +45,11 @@ class dvbt_scanner(grc_wxgui.top_block_gui):
         # Variables
         ##################################################
         self.threshold = threshold = -60
-        self.signal_level = signal_level = 0
         self.samp_rate = samp_rate = 2048000
         self.freq = freq = 525200000
         self.fft_size = fft_size = 1024
-        self.detected = detected = 0
+        self.settle_samples = settle_samples = 262144
+        self.integration = integration = 1
 
         ##################################################
         # Blocks
@@ -79,7 +77,7 @@ class dvbt_scanner(grc_wxgui.top_block_gui):
         	proportion=1,
         )
         self.GridAdd(_threshold_sizer, 2, 0, 1, 1)
-        self.probe_signal_lvl = blocks.probe_signal_f()
+        self.level_sink_0 = level_sink(threshold, settle_samples // fft_size, freq)
         self.notebook = self.notebook = wx.Notebook(self.GetWin(), style=wx.NB_TOP)
         self.notebook.AddPage(grc_wxgui.Panel(self.notebook), "Spektrum")
         self.notebook.AddPage(grc_wxgui.Panel(self.notebook), "Output")
@@ -115,7 +113,7 @@ class dvbt_scanner(grc_wxgui.top_block_gui):
         	factor=1.0,
         	decimal_places=0,
         	ref_level=0,
-        	sample_rate=samp_rate,
+        	sample_rate=samp_rate / fft_size,
         	number_rate=15,
         	average=False,
         	avg_alpha=None,
@@ -132,7 +130,7 @@ class dvbt_scanner(grc_wxgui.top_block_gui):
         	factor=1.0,
         	decimal_places=1,
         	ref_level=0,
-        	sample_rate=samp_rate,
+        	sample_rate=samp_rate / fft_size,
         	number_rate=15,
         	average=False,
         	avg_alpha=0.03,
@@ -158,17 +156,6 @@ class dvbt_scanner(grc_wxgui.top_block_gui):
         	win=window.flattop,
         )
         self.notebook.GetPage(0).Add(self.wxgui_fftsink2_0.win)
-        def _signal_level_probe():
-            while True:
-                val = self.probe_signal_lvl.level()
-                try:
-                    self.set_signal_level(val)
-                except AttributeError:
-                    pass
-                time.sleep(1.0 / (5))
-        _signal_level_thread = threading.Thread(target=_signal_level_probe)
-        _signal_level_thread.daemon = True
-        _signal_level_thread.start()
         self.rtlsdr_source_0 = osmosdr.source( args="numchan=" + str(1) + " " + "hackrf=0" )
         self.rtlsdr_source_0.set_sample_rate(samp_rate)
         self.rtlsdr_source_0.set_center_freq(freq, 0)
@@ -182,43 +169,18 @@ class dvbt_scanner(grc_wxgui.top_block_gui):
         self.rtlsdr_source_0.set_antenna("", 0)
         self.rtlsdr_source_0.set_bandwidth(0, 0)
           
-        self.probe_detected = blocks.probe_signal_f()
         self.fft_vxx_0 = fft.fft_vcc(fft_size, True, (window.rectangular(fft_size)), True, 1)
-        def _detected_probe():
-            while True:
-                val = self.probe_detected.level()
-                try:
-                    self.set_detected(val)
-                except AttributeError:
-                    pass
-                time.sleep(1.0 / (5))
-        _detected_thread = threading.Thread(target=_detected_probe)
-        _detected_thread.daemon = True
-        _detected_thread.start()
-        self.blocks_vector_to_stream_0 = blocks.vector_to_stream(gr.sizeof_float*1, fft_size)
-        self.blocks_threshold_ff_0 = blocks.threshold_ff(threshold, threshold, threshold)
+        self.energy_detector_0 = energy_detector(fft_size, integration, threshold)
         self.blocks_stream_to_vector_0 = blocks.stream_to_vector(gr.sizeof_gr_complex*1, fft_size)
-        self.blocks_nlog10_ff_0 = blocks.nlog10_ff(10, 1, 0)
-        self.blocks_moving_average_xx_0 = blocks.moving_average_ff(1000, 0.001, 4000)
-        self.blocks_divide_xx_0 = blocks.divide_ff(1)
-        self.blocks_complex_to_mag_squared_0 = blocks.complex_to_mag_squared(fft_size)
-        self.analog_const_source_x_0 = analog.sig_source_f(0, analog.GR_CONST_WAVE, 0, 0, 1048580)
 
         ##################################################
         # Connections
         ##################################################
-        self.connect((self.analog_const_source_x_0, 0), (self.blocks_divide_xx_0, 1))    
-        self.connect((self.blocks_complex_to_mag_squared_0, 0), (self.blocks_vector_to_stream_0, 0))    
-        self.connect((self.blocks_divide_xx_0, 0), (self.blocks_nlog10_ff_0, 0))    
-        self.connect((self.blocks_moving_average_xx_0, 0), (self.blocks_threshold_ff_0, 0))    
-        self.connect((self.blocks_moving_average_xx_0, 0), (self.probe_signal_lvl, 0))    
-        self.connect((self.blocks_moving_average_xx_0, 0), (self.wxgui_numbersink2_0, 0))    
-        self.connect((self.blocks_nlog10_ff_0, 0), (self.blocks_moving_average_xx_0, 0))    
         self.connect((self.blocks_stream_to_vector_0, 0), (self.fft_vxx_0, 0))    
-        self.connect((self.blocks_threshold_ff_0, 0), (self.probe_detected, 0))    
-        self.connect((self.blocks_threshold_ff_0, 0), (self.wxgui_numbersink2_1, 0))    
-        self.connect((self.blocks_vector_to_stream_0, 0), (self.blocks_divide_xx_0, 0))    
-        self.connect((self.fft_vxx_0, 0), (self.blocks_complex_to_mag_squared_0, 0))    
+        self.connect((self.energy_detector_0, 0), (self.level_sink_0, 0))    
+        self.connect((self.energy_detector_0, 0), (self.wxgui_numbersink2_0, 0))    
+        self.connect((self.energy_detector_0, 1), (self.wxgui_numbersink2_1, 0))    
+        self.connect((self.fft_vxx_0, 0), (self.energy_detector_0, 0))    
         self.connect((self.rtlsdr_source_0, 0), (self.blocks_stream_to_vector_0, 0))    
         self.connect((self.rtlsdr_source_0, 0), (self.wxgui_fftsink2_0, 0))    
 
@@ -229,14 +191,31 @@ class dvbt_scanner(grc_wxgui.top_block_gui):
         self.threshold = threshold
         self._threshold_slider.set_value(self.threshold)
         self._threshold_text_box.set_value(self.threshold)
-        self.blocks_threshold_ff_0.set_hi(self.threshold)
-        self.blocks_threshold_ff_0.set_lo(self.threshold)
+        self.energy_detector_0.set_threshold(self.threshold)
+        self.level_sink_0.set_threshold(self.threshold)
+
+    # The latest measurement at the current frequency, nothing is reported until the skipped samples passed
+    def get_measurement(self):
+        return self.level_sink_0.get_measurement()
 
     def get_signal_level(self):
-        return self.signal_level
+        measurement = self.get_measurement()
+        return measurement["level"] if measurement else None
+
+    def get_detected(self):
+        measurement = self.get_measurement()
+        return measurement["detected"] if measurement else None
+
+    # Level estimates (one per FFT) at the current frequency, used to wait until the level settled after a retune
+    def wait_levels(self, count=1, timeout=None):
+        return self.level_sink_0.wait_levels(count, timeout)
 
-    def set_signal_level(self, signal_level):
-        self.signal_level = signal_level
+    def get_settle_samples(self):
+        return self.settle_samples
+
+    def set_settle_samples(self, settle_samples):
+        self.settle_samples = settle_samples
+        self.level_sink_0.set_skip(self.settle_samples // self.fft_size)
 
     def get_samp_rate(self):
         return self.samp_rate
@@ -255,6 +234,7 @@ class dvbt_scanner(grc_wxgui.top_block_gui):
         self._freq_text_box.set_value(self.freq)
         self.rtlsdr_source_0.set_center_freq(self.freq, 0)
         self.wxgui_fftsink2_0.set_baseband_freq(self.freq)
+        self.level_sink_0.retune(self.freq)
 
     def get_fft_size(self):
         return self.fft_size
@@ -262,11 +242,12 @@ class dvbt_scanner(grc_wxgui.top_block_gui):
     def set_fft_size(self, fft_size):
         self.fft_size = fft_size
 
-    def get_detected(self):
-        return self.detected
+    def get_integration(self):
+        return self.integration
 
-    def set_detected(self, detected):
-        self.detected = detected
+    def set_integration(self, integration):
+        self.integration = integration
+        self.energy_detector_0.set_length(self.integration)
 
 
 def main(top_block_cls=dvbt_scanner, options=None):
@@ -1,8 +1,11 @@
 #!/usr/bin/env python2
-import csv
 from optparse import OptionParser
-from sklearn.metrics import roc_curve, auc
+from multiprocessing import Pool
+from sklearn.metrics import auc
 from scipy.stats import norm
+import hashlib
+import json
+import os
 import numpy as np
 import matplotlib as mpl
 mpl.use('pgf')
@@ -10,9 +13,15 @@ mpl.use('pgf')
 # Variables
 dvbt_freq = [498, 522, 698, 722, 762] 	# The DVB-T frequencies in Delft
 dvbt_width = 7.61						# Width of a DVB-T channel in MHz
-random_cnt = 10000						# Amount of random number generated
+channel_file = None						# The DVB-T channel table (the Delft channels when not given)
+threshold_min = -90						# Minimum threshold in dB of the normal distribution ROC and PDF
+threshold_max = -60						# Maximum threshold in dB of the normal distribution ROC and PDF
+threshold_cnt = 1000					# Amount of thresholds of the normal distribution ROC and PDF
 input_file = "results/detector.csv"		# The input file from the DVB-T detector
 output_file_prefix = ""					# Output file prefix for the figures
+processes = None						# Amount of processes rendering the figures (one per CPU when not given)
+cache_file = "results/figure_cache.json"	# The hashes of the figure inputs, unchanged figures are not rendered again
+style_functions = ['figsize', 'new_plot', 'save_plot']	# The styling shared by all figures, which is in their hashes
 verbose = True							# Enable debugging information
 
 # Calculate figure size based on LaTex text width
@@ -64,21 +73,39 @@ def print_debug(text):
 	if verbose:
 		print(text)
 
-# Calculate the statistics
-def calc_statistics(meas):
+# Get the threshold grid of the normal distributions (from high to low, so the ROC starts at 0)
+def threshold_grid():
+	return np.linspace(threshold_max, threshold_min, threshold_cnt)
+
+# Calculate the statistics, with the normal distribution evaluated on the grid
+def calc_statistics(meas, grid=None):
+	if grid is None:
+		grid = threshold_grid()
 	mean = np.mean(meas)
 	std = np.std(meas)
-	norm_dist = norm(mean, std)
-	rvs = norm_dist.rvs(random_cnt)
-	rvs.sort()
-	pdf = norm_dist.pdf(rvs)
-	cdf = norm_dist.cdf(rvs)
-	return (mean, std, rvs, pdf, cdf)
-
-# Find nearest value in array
-def find_nearest(array,value):
-    idx = (np.abs(array-value)).argmin()
-    return idx
+	pdf = norm.pdf(grid, mean, std)
+	cdf = norm.cdf(grid, mean, std)
+	return (mean, std, grid, pdf, cdf)
+
+# Calculate the ROC of normal distributed positive and negative measurements on the thresholds
+def norm_roc(pos_mean, pos_std, neg_mean, neg_std, thresholds):
+	(true_positive_rate, false_positive_rate) = norm.sf(thresholds, [[pos_mean], [neg_mean]], [[pos_std], [neg_std]])
+	return (false_positive_rate, true_positive_rate)
+
+# Calculate the ROC of the measurements (detected when at least the threshold) from the sorted measurements of both
+# classes, on the given thresholds or on every measured level like roc_curve
+def empirical_roc(actual, measurement, thresholds=None):
+	actual = np.asarray(actual, dtype=bool)
+	measurement = np.asarray(measurement, dtype=float)
+	positive = np.sort(measurement[actual])
+	negative = np.sort(measurement[~actual])
+	if thresholds is None:
+		thresholds = np.r_[np.inf, np.unique(measurement)[::-1]]
+
+	# The amount of measurements of at least the threshold in every class
+	true_positive_rate = (len(positive) - np.searchsorted(positive, thresholds, side='left')) / float(len(positive))
+	false_positive_rate = (len(negative) - np.searchsorted(negative, thresholds, side='left')) / float(len(negative))
+	return (false_positive_rate, true_positive_rate, thresholds)
 
 # Plot an ROC curve
 def plot_roc_curve(false_positive_rate, true_positive_rate, filename):
@@ -98,11 +125,11 @@ def plot_roc_curve(false_positive_rate, true_positive_rate, filename):
 	save_plot(filename)
 
 # Plot the PDF curve
-def plot_pdf_curve(pos_rvs, pos_pdf, neg_rvs, neg_pdf, filename):
+def plot_pdf_curve(pos_grid, pos_pdf, neg_grid, neg_pdf, filename):
 	# Generate the plot
 	fig, ax = new_plot(0.9)
-	ax.plot(pos_rvs, pos_pdf, 'g', label='DVB-T signal')
-	ax.plot(neg_rvs, neg_pdf, 'r', label='Noise')
+	ax.plot(pos_grid, pos_pdf, 'g', label='DVB-T signal')
+	ax.plot(neg_grid, neg_pdf, 'r', label='Noise')
 	ax.set_xlim([-90,-60])
 	ax.legend(loc='lower right')
 	ax.set_ylabel('Probability density')
@@ -110,99 +137,184 @@ def plot_pdf_curve(pos_rvs, pos_pdf, neg_rvs, neg_pdf, filename):
 	save_plot(filename)
 
 	
+# Load the DVB-T channels (center frequency and optional width in MHz per line) from a file, or use the Delft channels
+def load_channels(filename=None):
+	if filename == None:
+		return (np.array(dvbt_freq, dtype=float), np.full(len(dvbt_freq), dvbt_width))
+	centers = []
+	widths = []
+	with open(filename) as in_f:
+		for line in in_f:
+			fields = line.split('#')[0].split(',')
+			if fields[0].strip():
+				centers.append(float(fields[0]))
+				widths.append(float(fields[1]) if len(fields) > 1 and fields[1].strip() else dvbt_width)
+	return (np.array(centers), np.array(widths))
+
+# Get the sorted edges of the channels, overlapping channels are merged
+def channel_edges(centers, widths):
+	order = np.argsort(centers)
+	lows = centers[order] - widths[order]/2
+	highs = centers[order] + widths[order]/2
+	edges = []
+	for (low, high) in zip(lows, highs):
+		if edges and low <= edges[-1][1]:
+			edges[-1][1] = max(edges[-1][1], high)
+		else:
+			edges.append([low, high])
+	edges = np.array(edges).reshape(-1, 2)
+	return (edges[:, 0], edges[:, 1])
+
+# Check which frequencies are within (not on the edge of) a channel
+def in_channels(freqs, lows, highs):
+	idx = np.searchsorted(lows, freqs, side='right') - 1
+	inside = idx >= 0
+	inside[inside] = (freqs[inside] > lows[idx[inside]]) & (freqs[inside] < highs[idx[inside]])
+	return inside
+
 # Read measurements
-def read_measurements():
-	# Setup variables
-	actual = []
-	measurement = []
-	positive_meas = []
-	negative_meas = []
-
-	# Open the input file
-	with open(input_file, 'rb') as in_f:
-		reader = csv.reader(in_f)
-
-		# Go trough all the measurements
-		for row in reader:
-
-			# Check if this is an actual DVB-T station
-			is_dvbt = False
-			for freq in dvbt_freq:
-				if (freq - dvbt_width/2) < float(row[0]) < (freq + dvbt_width/2):
-					is_dvbt = True
-					break
-
-			# For the actual ROC curve
-			actual.append(is_dvbt)
-			measurement.append(float(row[2]))
-
-			# For the random ROC cruve
-			if is_dvbt:
-				positive_meas.append(float(row[2]))
-			else:
-				negative_meas.append(float(row[2]))
-
-	# Return information
-	return (actual, measurement, positive_meas, negative_meas)
-
-# Generate All the graphs
-def gen_graphs():
+def read_measurements(filename=None):
+	# Only read the frequency and level columns
+	data = np.loadtxt(filename or input_file, delimiter=',', usecols=(0, 2), ndmin=2)
+	freqs = data[:, 0]
+	measurement = data[:, 1]
+
+	# Check which measurements are of an actual DVB-T station
+	(lows, highs) = channel_edges(*load_channels(channel_file))
+	actual = in_channels(freqs, lows, highs)
+
+	# Return information for the actual and the normal distributed ROC curves
+	return (actual, measurement, measurement[actual], measurement[~actual])
+
+# Calculate all the figures of a measurement file, returns the figures as (prefix, name, plot function, arguments)
+def calc_figures(filename, prefix):
 	# First read measurements
-	(actual, measurement, positive_meas, negative_meas) = read_measurements()
-	print_debug("Done reading measurements!")
+	(actual, measurement, positive_meas, negative_meas) = read_measurements(filename)
+	print_debug("Done reading measurements of %s!" % filename)
 
-	# Plot the actual ROC curve
-	false_positive_rate, true_positive_rate, thresholds = roc_curve(actual, measurement)
-	plot_roc_curve(false_positive_rate, true_positive_rate, "roc_real")
-	print_debug("Done plotting actual ROC!")
+	# The actual ROC curve
+	false_positive_rate, true_positive_rate, thresholds = empirical_roc(actual, measurement)
+	figures = [(prefix, "roc_real", "plot_roc_curve", (false_positive_rate, true_positive_rate))]
 
 	# Calculate statistics
-	(pos_mean, pos_std, pos_rvs, pos_pdf, pos_cdf) = calc_statistics(positive_meas)
-	(neg_mean, neg_std, neg_rvs, neg_pdf, neg_cdf) = calc_statistics(negative_meas)
+	(pos_mean, pos_std, pos_grid, pos_pdf, pos_cdf) = calc_statistics(positive_meas)
+	(neg_mean, neg_std, neg_grid, neg_pdf, neg_cdf) = calc_statistics(negative_meas)
 
 	# Debug information
 	print_debug("Statistics")
 	print_debug("  Positive mean: %.2f, std: %.2f" % (pos_mean, pos_std))
-	print_debug("  Negative mean: %.2f, std: %.2f" % (pos_mean, pos_std))
+	print_debug("  Negative mean: %.2f, std: %.2f" % (neg_mean, neg_std))
+
+	# The PDF graph and the ROC based on statistics
+	figures.append((prefix, "pdf", "plot_pdf_curve", (pos_grid, pos_pdf, neg_grid, neg_pdf)))
+	(curve_x, curve_y) = norm_roc(pos_mean, pos_std, neg_mean, neg_std, threshold_grid())
+	figures.append((prefix, "roc_norm", "plot_roc_curve", (curve_x, curve_y)))
+	return figures
+
+# Add the bytecode, constants and names of a function (with the code nested in it) to a hash
+def update_code_hash(sha, code):
+	sha.update(code.co_code + repr(code.co_names).encode('utf-8'))
+	for const in code.co_consts:
+		if hasattr(const, 'co_code'):
+			update_code_hash(sha, const)
+		else:
+			sha.update(repr(const).encode('utf-8'))
+
+# Get the content hash of the inputs of a figure (the data, the plot function and the styling of all figures)
+def figure_hash(figure):
+	(prefix, name, function, args) = figure
+	sha = hashlib.sha1(repr((prefix, name, function)).encode('utf-8'))
+	for style_function in [function] + style_functions:
+		update_code_hash(sha, globals()[style_function].__code__)
+	sha.update(json.dumps(pgf_with_latex, sort_keys=True).encode('utf-8'))
+	for arg in args:
+		sha.update(np.ascontiguousarray(arg, dtype=float).tobytes())
+	return sha.hexdigest()
+
+# Render a figure (run in the process pool)
+def render_figure(figure):
+	global output_file_prefix
+	(prefix, name, function, args) = figure
+	output_file_prefix = prefix
+	globals()[function](*(tuple(args) + (name,)))
+	plt.close('all')
+	return prefix + name
+
+# Load the hashes of the rendered figures
+def load_cache():
+	if cache_file and os.path.exists(cache_file):
+		with open(cache_file) as in_f:
+			return json.load(in_f)
+	return {}
+
+# Generate All the graphs of the measurement files (the input file when not given), only changed figures are rendered
+def gen_graphs(filenames=None, force=False):
+	# The figures of a batch are prefixed with the name of their measurement file
+	if filenames:
+		figures = []
+		for filename in filenames:
+			name = os.path.splitext(os.path.basename(filename))[0]
+			figures += calc_figures(filename, output_file_prefix + name + "_")
+	else:
+		figures = calc_figures(input_file, output_file_prefix)
 
-	# Plot the PDF graph
-	plot_pdf_curve(pos_rvs, pos_pdf, neg_rvs, neg_pdf, "pdf")
-	print_debug("Done plotting PDF curve!")
+	# Skip the figures with the same inputs as when they were rendered (the cache also keeps the figures of other
+	# measurement files, so it is loaded when all figures are rendered again as well)
+	cache = load_cache()
+	hashes = dict((figure[0] + figure[1], figure_hash(figure)) for figure in figures)
+	todo = [figure for figure in figures if force or cache.get(figure[0] + figure[1]) != hashes[figure[0] + figure[1]] or
+		not all(os.path.exists('results/{}.{}'.format(figure[0] + figure[1], ext)) for ext in ['pgf', 'pdf'])]
+	print_debug("Rendering %d of %d figures" % (len(todo), len(figures)))
 
-	# Calculate the ROC based on statistics
-	curve_x = []
-	curve_y = []
-	for x in np.arange(-85, -65, 0.1):
-		curve_x.append(neg_cdf[find_nearest(pos_rvs, x)])
-		curve_y.append(pos_cdf[find_nearest(neg_rvs, x)])
+	# Render in a process pool
+	if len(todo) > 1 and processes != 1:
+		pool = Pool(processes)
+		rendered = pool.map(render_figure, todo)
+		pool.close()
+		pool.join()
+	else:
+		rendered = [render_figure(figure) for figure in todo]
+	for name in rendered:
+		print_debug("Done plotting %s!" % name)
 
-	# Plot the ROC curve base on statistics
-	plot_roc_curve(curve_x, curve_y, "roc_norm")
-	print_debug("Done plotting normal distributed ROC!")
+	# Store the hashes of the rendered figures
+	if cache_file:
+		cache.update((name, hashes[name]) for name in rendered)
+		with open(cache_file, 'w') as out_f:
+			json.dump(cache, out_f, indent=1, sort_keys=True)
 
 
 # Main function
 if __name__ == '__main__':
 	# Setup the option parser
-	parser = OptionParser()
+	parser = OptionParser(usage="usage: %prog [options] [measurement files]",
+		description="Generate the graphs of the input file, or of all measurement files prefixed with their name")
 	parser.add_option("-q",
 		dest="verbose", action="store_false", default=verbose, help="Disables debugging information (quiet mode)")
 	parser.add_option("--dvbt_width",
 		dest="dvbt_width", type="float", default=dvbt_width, help="The DVB-T channel width in MHz")
-	parser.add_option("--random_cnt",
-		dest="random_cnt", type="int", default=random_cnt, help="Amount of random number generated for the Normal distributions")
+	parser.add_option("--channel_file",
+		dest="channel_file", type="string", default=channel_file, help="The DVB-T channel table with a center frequency and optional width in MHz per line")
+	parser.add_option("--threshold_cnt",
+		dest="threshold_cnt", type="int", default=threshold_cnt, help="Amount of thresholds for the Normal distributions")
 	parser.add_option("-i", "--input_file",
 		dest="input_file", type="string", default=input_file, help="The input file from the DVB-T detector")
 	parser.add_option("-o", "--output_file_prefix",
 		dest="output_file_prefix", type="string", default=output_file_prefix, help="The output file prefix for the figures")
+	parser.add_option("-j", "--processes",
+		dest="processes", type="int", default=processes, help="Amount of processes rendering the figures (default one per CPU)")
+	parser.add_option("-f", "--force",
+		dest="force", action="store_true", default=False, help="Render all figures, also the unchanged ones")
 
 	# Parse the options
 	(options, args) = parser.parse_args()
 	verbose = options.verbose
 	dvbt_width = options.dvbt_width
-	random_cnt = options.random_cnt
+	threshold_cnt = options.threshold_cnt
+	channel_file = options.channel_file
 	input_file = options.input_file
 	output_file_prefix = options.output_file_prefix
+	processes = options.processes
 
 	# Run all the graphs
-	gen_graphs()
\ No newline at end of file
+	gen_graphs(args, options.force)
\ No newline at end of file
@@ -0,0 +1,163 @@
+#!/usr/bin/env python2
+from optparse import OptionParser
+import os
+import time
+import numpy as np
+from sklearn.metrics import auc
+from gen_graphs import load_channels, channel_edges, in_channels
+
+# Variables
+input_file = "results/detector.csv"	# The output file of the DVB-T detector which is followed
+channel_file = None			# The DVB-T channel table (the Delft channels when not given)
+bin_min = -120				# Lowest threshold in dB of the streaming ROC
+bin_max = 0				# Highest threshold in dB of the streaming ROC
+bin_width = 0.1				# Width in dB of the threshold histogram bins
+poll_time = 1				# Time in seconds between the checks for new rows
+report_interval = 10			# Time in seconds between the reports
+verbose = True				# Enable debugging information
+
+# Print debug information
+def print_debug(text):
+	if verbose:
+		print(text)
+
+# Running mean and variance of a class (Welford, with batches merged like Chan et al.)
+class RunningStats:
+	def __init__(self):
+		self.count = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+
+	def add(self, values):
+		if len(values) == 0:
+			return
+		count = self.count + len(values)
+		delta = np.mean(values) - self.mean
+		self.m2 += np.sum((values - np.mean(values))**2) + delta**2 * self.count * len(values) / float(count)
+		self.mean += delta * len(values) / float(count)
+		self.count = count
+
+	def std(self):
+		return np.sqrt(self.m2 / self.count) if self.count > 0 else 0.0
+
+# ROC of all measurements so far from histograms over fixed thresholds
+class StreamingROC:
+	def __init__(self, bin_min=bin_min, bin_max=bin_max, bin_width=bin_width):
+		self.thresholds = np.arange(bin_min, bin_max + bin_width / 2, bin_width)
+
+		# Every bin counts the levels from its threshold up to the next one, with a bin below the lowest threshold
+		self.positive = np.zeros(len(self.thresholds) + 1, dtype=np.int64)
+		self.negative = np.zeros(len(self.thresholds) + 1, dtype=np.int64)
+
+	def add(self, levels, actual):
+		bins = np.searchsorted(self.thresholds, levels, side='right')
+		self.positive += np.bincount(bins[actual], minlength=len(self.positive))
+		self.negative += np.bincount(bins[~actual], minlength=len(self.negative))
+
+	# Get the false and true positive rates (detected when at least the threshold) from high to low thresholds
+	def roc(self):
+		positive = np.cumsum(self.positive[::-1])[:-1] / float(max(np.sum(self.positive), 1))
+		negative = np.cumsum(self.negative[::-1])[:-1] / float(max(np.sum(self.negative), 1))
+		return (np.r_[0, negative], np.r_[0, positive], self.thresholds[::-1])
+
+	def auc(self):
+		(false_positive_rate, true_positive_rate, thresholds) = self.roc()
+		return auc(np.r_[false_positive_rate, 1], np.r_[true_positive_rate, 1])
+
+	# Get the threshold with the highest Youden's J (true positive rate - false positive rate)
+	def best_threshold(self):
+		(false_positive_rate, true_positive_rate, thresholds) = self.roc()
+		best = np.argmax(true_positive_rate[1:] - false_positive_rate[1:])
+		return (thresholds[best], true_positive_rate[best + 1] - false_positive_rate[best + 1])
+
+# Follow a file and get the new complete lines on every call, starts over when the file is rewritten
+class FileTail:
+	def __init__(self, filename):
+		self.filename = filename
+		self.position = 0
+		self.rest = ""
+
+	def read_lines(self):
+		if not os.path.exists(self.filename):
+			return []
+		if os.path.getsize(self.filename) < self.position:
+			self.position = 0
+			self.rest = ""
+		with open(self.filename) as in_f:
+			in_f.seek(self.position)
+			data = self.rest + in_f.read()
+			self.position = in_f.tell()
+		lines = data.split("\n")
+		self.rest = lines.pop()
+		return [line for line in lines if line.strip()]
+
+# Incremental analyzer of the detector output
+class LiveAnalyzer:
+	def __init__(self, channel_file=channel_file, bin_width=bin_width):
+		(self.lows, self.highs) = channel_edges(*load_channels(channel_file))
+		self.positive = RunningStats()
+		self.negative = RunningStats()
+		self.roc = StreamingROC(bin_width=bin_width)
+		self.rows = 0
+
+	# Add the new CSV rows (frequency, threshold, level, detected)
+	def add_lines(self, lines):
+		if len(lines) == 0:
+			return
+		data = np.array([line.split(",")[:3] for line in lines], dtype=float).reshape(-1, 3)
+		actual = in_channels(data[:, 0], self.lows, self.highs)
+		levels = data[:, 2]
+		self.positive.add(levels[actual])
+		self.negative.add(levels[~actual])
+		self.roc.add(levels, actual)
+		self.rows += len(lines)
+
+	def report(self):
+		text = "%d rows, DVB-T: %d (mean %.2fdB, std %.2fdB), noise: %d (mean %.2fdB, std %.2fdB)" % (self.rows,
+			self.positive.count, self.positive.mean, self.positive.std(), self.negative.count, self.negative.mean,
+			self.negative.std())
+		if self.positive.count > 0 and self.negative.count > 0:
+			(threshold, j) = self.roc.best_threshold()
+			text += ", AUC %.3f, suggested threshold %.1fdB (J = %.2f)" % (self.roc.auc(), threshold, j)
+		return text
+
+# Main function
+if __name__ == '__main__':
+	# Setup the option parser
+	parser = OptionParser(description="Follow the output of the DVB-T detector and report the detection performance")
+	parser.add_option("-q",
+		dest="verbose", action="store_false", default=verbose, help="Only print the reports")
+	parser.add_option("-i", "--input_file",
+		dest="input_file", type="string", default=input_file, help="The output file of the DVB-T detector")
+	parser.add_option("--channel_file",
+		dest="channel_file", type="string", default=channel_file, help="The DVB-T channel table with a center frequency and optional width in MHz per line")
+	parser.add_option("--bin_width",
+		dest="bin_width", type="float", default=bin_width, help="Width in dB of the threshold histogram bins")
+	parser.add_option("--report_interval",
+		dest="report_interval", type="float", default=report_interval, help="Time in seconds between the reports")
+	parser.add_option("--once",
+		dest="once", action="store_true", default=False, help="Report on the rows written so far and stop")
+
+	# Parse the options
+	(options, args) = parser.parse_args()
+	verbose = options.verbose
+
+	# Only the new rows are added to the statistics on every check
+	analyzer = LiveAnalyzer(options.channel_file, options.bin_width)
+	tail = FileTail(options.input_file)
+	next_report = time.time() + options.report_interval
+	try:
+		while True:
+			lines = tail.read_lines()
+			analyzer.add_lines(lines)
+			if lines:
+				print_debug("Read %d new rows" % len(lines))
+			if options.once:
+				break
+			if time.time() >= next_report:
+				print(analyzer.report())
+				next_report += options.report_interval
+			time.sleep(poll_time)
+	except KeyboardInterrupt:
+		pass
+	print(analyzer.report())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+from optparse import OptionParser
+import time
+import decode
+from generate import Gen2Generator
+
+# Variables
+traces = ["signal.txt", "example_trace_rfid.txt"]   # The bundled traces
+repeat = 200                                        # Amount of decode passes per measurement
+sizes = [10000, 100000, 1000000, 10000000, 100000000]  # Capture sizes (in samples) of the synthetic benchmark
+block_size = 1000000                                # Synthetic samples generated once and repeated up to the size
+
+# R->T decoder matching the commands on a string of bits (the implementation before the lookup table)
+class StringRFIDDecoder(decode.RFIDDecoder):
+    def rt_decode(self):
+        bits = ""
+        cur_command = None
+        while self.cur_peak < self.peak_cnt:
+            p = self.peaks[self.cur_peak]
+            prev_p = self.peaks[self.cur_peak-1] if self.cur_peak > 0 else 0
+
+            # Get the bit
+            bit = self.rt_get_bit(p, prev_p)
+            bits += str(bit)
+            self.cur_peak += 1
+
+            # Go trough all command and check if bits match
+            if cur_command == None and len(bits) >= 2:
+                for command in decode.commands:
+                    if command[0] == bits:
+                        cur_command = command
+                        break
+
+            # Parse the command if finished
+            elif cur_command != None and len(bits) >= cur_command[2]:
+                real_bits = [int(bit) for bit in bits[len(cur_command[0]):]]
+                payload = int("".join(str(bit) for bit in real_bits), 2)
+                frame = decode.Frame(cur_command[1], (int)(self.offset + self.frame_start), payload, len(real_bits))
+
+                handler = getattr(self, "handle_%s" % cur_command[1], None)
+                if handler:
+                    frame = handler(frame)
+                return frame
+
+        if len(bits) > 0:
+            return decode.Frame(None, (int)(self.offset + self.frame_start), int(bits, 2), len(bits), valid=False)
+        return None
+
+# Only decode the R->T commands and skip the T->R responses
+class RTOnly:
+    def tr_response(self, frame, bits_cnt):
+        return frame
+
+class StringRTDecoder(RTOnly, StringRFIDDecoder):
+    pass
+
+class TableRTDecoder(RTOnly, decode.RFIDDecoder):
+    pass
+
+# Decoder measuring the time spent in the peak detection, the R->T decoding and the T->R decoding
+class TimedDecoder(decode.RFIDDecoder):
+    def __init__(self, data, *args, **kwargs):
+        self.times = {'peaks': 0.0, 'rt': 0.0, 'tr': 0.0}
+        self.responses = 0
+        decode.RFIDDecoder.__init__(self, data, *args, **kwargs)
+
+    # The peaks are detected (after calibrating) on every new data
+    def set_data(self, data, offset=0):
+        start = time.time()
+        decode.RFIDDecoder.set_data(self, data, offset)
+        self.times['peaks'] += time.time() - start
+
+    # Time every frame, the T->R time is subtracted afterwards
+    def decode(self, limit=None):
+        frames = decode.RFIDDecoder.decode(self, limit)
+        while True:
+            start = time.time()
+            frame = next(frames, None)
+            self.times['rt'] += time.time() - start
+            if frame == None:
+                return
+            yield frame
+
+    def tr_response(self, frame, bits_cnt):
+        start = time.time()
+        frame = decode.RFIDDecoder.tr_response(self, frame, bits_cnt)
+        self.times['tr'] += time.time() - start
+        if frame.response != None:
+            self.responses += 1
+        return frame
+
+# Measure the decoding time of all frames (the peaks are only detected once)
+def decode_time(decoder):
+    frames = 0
+    start = time.time()
+    for i in range(repeat):
+        decoder.cur_peak = 0
+        frames += len(list(decoder.decode()))
+    return (time.time() - start, frames)
+
+# Run the benchmark on a trace
+def benchmark(filename):
+    data = decode.load_samples(filename)
+    print("%s (%d samples)" % (filename, len(data)))
+
+    for (name, cls) in [("R->T string", StringRTDecoder), ("R->T table", TableRTDecoder),
+                        ("Full string", StringRFIDDecoder), ("Full table", decode.RFIDDecoder)]:
+        (total, frames) = decode_time(cls(data))
+        if frames > 0:
+            print("  %-12s %8.2f us/frame" % (name, total / frames * 1e6))
+        else:
+            print("  %-12s %8.2f us/pass (no frames)" % (name, total / repeat * 1e6))
+
+# Repeat the block of samples in chunks up to size samples
+def synthetic_chunks(block, size):
+    for i in range(0, size, len(block)):
+        yield block[:min(len(block), size - i)]
+
+# Run the benchmark on synthetic captures of all sizes, which are streamed trough the decoder
+def benchmark_synthetic(sizes, miller=1):
+    generator = Gen2Generator(miller=miller)
+    block = generator.generate(min(max(sizes), block_size))
+    print("Synthetic %s capture (Tari %d, Tpri %.2f samples)" % ("Miller-%d" % miller if miller > 1 else "FM0",
+        generator.tari, generator.tpri))
+    print("%12s  %-6s %10s %12s" % ("samples", "phase", "MS/s", "frames/s"))
+
+    for size in sizes:
+        decoder = TimedDecoder([])
+        start = time.time()
+        frames = sum(1 for frame in decode.decode_stream(synthetic_chunks(block, size), decoder))
+        total = time.time() - start
+
+        # The T->R rate is in responses instead of frames
+        times = decoder.times
+        for (phase, seconds, count) in [("peaks", times['peaks'], frames), ("R->T", times['rt'] - times['tr'], frames),
+                                        ("T->R", times['tr'], decoder.responses), ("total", total, frames)]:
+            print("%12s  %-6s %10.2f %12.1f" % (size if phase == "peaks" else "", phase,
+                size / seconds / 1e6 if seconds > 0 else 0, count / seconds if seconds > 0 else 0))
+        print("%12s  %d good, %d bad frames, %d responses" % ("", decoder.good_frames, decoder.bad_frames,
+            decoder.responses))
+
+# Main function
+def main():
+    global repeat
+
+    # Setup the option parser
+    parser = OptionParser(usage="usage: %prog [options] [trace ...]")
+    parser.add_option("-r", "--repeat",
+        dest="repeat", type="int", default=repeat, help="Amount of decode passes per measurement")
+    parser.add_option("-s", "--synthetic",
+        dest="synthetic", action="store_true", default=False, help="Benchmark synthetic captures instead of traces")
+    parser.add_option("-n", "--sizes",
+        dest="sizes", type="string", default=",".join(str(size) for size in sizes),
+        help="Comma separated capture sizes of the synthetic benchmark")
+    parser.add_option("-m", "--miller",
+        dest="miller", type="choice", choices=["1", "2", "4", "8"], default="1",
+        help="1 for FM0, or the Miller M of the synthetic captures")
+
+    # Parse the options
+    (options, args) = parser.parse_args()
+    repeat = options.repeat
+
+    if options.synthetic:
+        benchmark_synthetic([int(float(size)) for size in options.sizes.split(",")], int(options.miller))
+        return
+
+    for filename in (args or traces):
+        benchmark(filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+from optparse import OptionParser
+import os
+from decode import convert_samples, sample_formats
+
+# Main function
+def main():
+    # Setup the option parser
+    parser = OptionParser(usage="usage: %prog [options] input_file output_file",
+        description="Convert a text sample file (one float per line) to a raw sample file. " +
+            "The format is selected by the output extension: " + ", ".join(sorted(sample_formats)))
+
+    # Parse the options
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error("Expected an input and an output file")
+    if os.path.splitext(args[1])[1].lower() not in sample_formats:
+        parser.error("Unknown output format for %s" % args[1])
+
+    convert_samples(args[0], args[1])
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,37 @@
 #!/usr/bin/env python
+from collections import namedtuple
+from functools import partial
+from optparse import OptionParser
+import binascii
+import csv
+import glob
+import json
+from itertools import islice
+from multiprocessing import Pool
+import os
+import time
 import numpy as np
-import matplotlib.pyplot as plt
+from scipy.ndimage import minimum_filter1d
 from scipy.signal import find_peaks_cwt
 
-# Some defines that need to be set
+# Some defines that need to be set (the defaults when they can't be calibrated from the data)
 tari = 71            # The calculated Tari length
 min_rt_th = 0.3      # Minimum amount of distance between peak and -0.5*tari of R->T
 min_tr_th = 0.02     # Minimum amount of distance between peak and T->R
 tpri = 16.3          # Normaly this can be calculated based on the Query
+rt_th_ratio = 0.45   # Calibrated min_rt_th relative to the signal amplitude
+tr_th_ratio = 0.03   # Calibrated min_tr_th relative to the signal amplitude
+calib_len = 1000000  # Amount of samples at the start of the data used for calibration
+calib_depth = 0.5    # Minimum modulation depth (relative to the carrier) of the data used for calibration
+peak_width = 4       # Width in samples of the matched filter used by the fast peak detector
+max_tr_bits = 528    # Maximum length of a T->R response (PC + 496 bits EPC + CRC-16)
+resync_symbols = 32  # Amount of T->R symbols (over M for Miller) between the resyncs of the symbol clock
+chunk_size = 262144  # Amount of samples read at once when streaming
+workers = None       # Amount of worker processes in batch mode (None uses all cores)
+max_annotations = 1000000   # Maximum amount of decoded bits kept for the plot
+max_plot_points = 100000    # Longer data is plotted as its min/max envelope
+input_file = "signal.txt"               # The capture to decode and plot
+output_file = "results.jsonl"           # The batch results file (.jsonl or .csv)
 
 ###### ------------ Code starts here ------------ ######
 # Commands
@@ -20,39 +44,329 @@ commands = [
     ('11000001',  'Req_RN',  40, 16),
 ]
 
+# Build a lookup table from (amount of bits, bits) to the command, or None when it is only the prefix of a command
+def build_command_table(commands):
+    table = {}
+    for command in commands:
+        code = command[0]
+        for i in range(1, len(code)):
+            table.setdefault((i, int(code[:i], 2)), None)
+        table[(len(code), int(code, 2))] = command
+    return table
+
+command_table = build_command_table(commands)
+
 # T->R preamble
 tr_preamble = [1, 0, 1, 0, 1, 1]
+tr_violation = 4                        # The FM0 preamble symbol without a level inversion at the start
+miller_preamble = [0, 1, 0, 1, 1, 1]
+
+# Raw sample formats (as written by a GNU Radio file sink) based on the file extension
+sample_formats = {
+    '.f32':   np.float32,
+    '.bin':   np.float32,
+    '.raw':   np.float32,
+    '.fc32':  np.complex64,
+    '.cf32':  np.complex64,
+    '.cfile': np.complex64,
+}
+
+# Ricker (mexican hat) wavelet, the same shape find_peaks_cwt correlates with
+def ricker(points, a):
+    vec = np.arange(points) - (points - 1.0) / 2
+    return (1 - vec**2 / a**2) * np.exp(-vec**2 / (2.0 * a**2))
+
+# Remove the peaks which don't drop enough compared to -0.5*tari before them
+def filter_rt_peaks(data, peaks, tari, min_rt_th):
+    peaks = peaks[peaks >= (int)(0.5*tari)]
+    return peaks[(data[(peaks - 0.5*tari).astype(int)] - data[peaks]) > min_rt_th]
+
+# Fast peak detector based on a matched filter and a sliding minimum
+def find_peaks_fast(data, tari=tari, min_rt_th=min_rt_th, width=peak_width):
+    data = np.asarray(data, dtype=float)
+    if len(data) == 0:
+        return np.array([], dtype=int)
+
+    # Correlate with a single wavelet matched to the reader pulse
+    filtered = np.convolve(data, ricker(min(10*width, len(data)), width), mode='same')
+
+    # Only keep the local minima within half a tari
+    window = 2*(int)(0.45*tari) + 1
+    peaks = np.flatnonzero(filtered == minimum_filter1d(filtered, window, mode='nearest'))
+    return filter_rt_peaks(data, peaks, tari, min_rt_th)
+
+# Accurate (but slow) peak detector using the continuous wavelet transform
+def find_peaks_accurate(data, tari=tari, min_rt_th=min_rt_th):
+    data = np.asarray(data, dtype=float)
+    if len(data) == 0:
+        return np.array([], dtype=int)
+
+    peaks = np.asarray(find_peaks_cwt(-data, np.arange(1, 0.9*tari)), dtype=int)
+    return filter_rt_peaks(data, peaks, tari, min_rt_th)
+
+# Available peak detectors
+peak_detectors = {
+    'fast':     find_peaks_fast,
+    'accurate': find_peaks_accurate,
+}
+
+# Table driven CRC calculation over a number of bits (MSB first)
+class CRC:
+    def __init__(self, width, poly, preset, xor_out=0):
+        # Registers smaller than a byte are shifted up to 8 bits
+        self.shift = max(0, 8 - width)
+        self.width = width + self.shift
+        self.mask = (1 << self.width) - 1
+        self.poly = poly << self.shift
+        self.preset = preset << self.shift
+        self.xor_out = xor_out
+        self.table = [self.update_bits(i << (self.width - 8), 0, 8) for i in range(256)]
+
+    # Shift count bits of value into the register one by one
+    def update_bits(self, reg, value, count):
+        for i in range(count - 1, -1, -1):
+            feedback = (reg >> (self.width - 1)) ^ (value >> i)
+            reg = (reg << 1) & self.mask
+            if feedback & 1:
+                reg ^= self.poly
+        return reg
+
+    # Calculate the CRC over the length bits of value
+    def calc(self, value, length):
+        lead = length % 8
+        reg = self.update_bits(self.preset, value >> (length - lead), lead)
+
+        # Go trough the rest byte by byte
+        for i in range(length - lead - 8, -1, -8):
+            byte = (value >> i) & 0xFF
+            reg = ((reg << 8) & self.mask) ^ self.table[((reg >> (self.width - 8)) ^ byte) & 0xFF]
+        return (reg >> self.shift) ^ self.xor_out
+
+# The Gen2 CRCs by their length
+crcs = {
+    5:  CRC(5, 0x09, 0x09),
+    16: CRC(16, 0x1021, 0xFFFF, 0xFFFF),
+}
+
+# Decoded R->T command with the T->R response (bit fields are packed in integers)
+class Frame(namedtuple('Frame', ['command', 'offset', 'payload', 'payload_len', 'rn16', 'pc', 'epc', 'crc',
+                                 'response', 'response_len', 'valid'])):
+    __slots__ = ()
+
+    # Get count bits from the payload starting at bit start
+    def field(self, start, count):
+        return (self.payload >> (self.payload_len - start - count)) & ((1 << count) - 1)
+
+Frame.__new__.__defaults__ = (None, None, None, None, None, 0, True)
+
+# Pack an array of bits (MSB first) in an integer
+def pack_bits(bits):
+    if len(bits) == 0:
+        return 0
+    packed = np.packbits(np.asarray(bits, dtype=np.uint8))
+    return int(binascii.hexlify(packed.tobytes()), 16) >> (8*len(packed) - len(bits))
+
+# Convert an integer to a string of length bits
+def bits_str(value, length):
+    if length == 0:
+        return ""
+    return format(value, '0%db' % length)
+
+# Estimate the carrier (high) and floor (low) level of the reader signal
+def estimate_levels(data):
+    return (np.percentile(data, 99), np.percentile(data, 0.5))
+
+# Estimate Tari from the data-0 symbol after the delimiters, which lasts from the rising edge ending the
+# delimiter up to the rising edge ending the data-0 pulse (returns None without any delimiter)
+def estimate_tari(data, mid):
+    low = np.asarray(data) < mid
+    falling = np.flatnonzero(~low[:-1] & low[1:]) + 1
+    rising = np.flatnonzero(low[:-1] & ~low[1:]) + 1
+    if len(falling) == 0:
+        return None
+
+    # Get the width of every low pulse
+    rising = rising[rising > falling[0]]
+    if len(rising) < 2:
+        return None
+    widths = rising - falling[np.searchsorted(falling, rising) - 1]
+
+    # The delimiter is a lot longer than the pulses and Tari is between half and twice the delimiter
+    delims = np.flatnonzero(widths[:-1] > 2*np.median(widths))
+    data0 = rising[delims + 1] - rising[delims]
+    data0 = data0[(0.4*widths[delims] <= data0) & (data0 <= 2.2*widths[delims])]
+    if len(data0) == 0:
+        return None
+    return float(np.median(data0))
+
+# Get the sub-sample position of the low pulse at peak p, halfway its falling and rising edge, which are linearly
+# interpolated where the data crosses halfway the carrier before the pulse and the bottom of the pulse
+def pulse_center(data, p, tari):
+    before = (int)(p - 0.5*tari)
+    after = (int)(p + 0.5*tari)
+    if before < 0 or after >= len(data):
+        return float(p)
+    mid = (data[before] + data[p]) / 2
+
+    # The last sample above halfway before the peak and the first one after it
+    falling = before + np.flatnonzero(data[before:p+1] >= mid)[-1]
+    rising = p + np.argmax(data[p:after+1] >= mid)
+    if data[rising] < mid:
+        return float(p)
+    falling += (data[falling] - mid) / (data[falling] - data[falling+1])
+    rising -= (data[rising] - mid) / (data[rising] - data[rising-1])
+    return (falling + rising) / 2
+
+# Amount of samples a single R->T command with its T->R response can span
+def frame_length(tari=tari, tpri=tpri):
+    max_rt_bits = max(command[2] for command in commands)
+    rt_length = (13 + 2*max_rt_bits) * tari
+    tr_length = (10 + (16 + len(miller_preamble) + max_tr_bits) * 8) * tpri
+    return (int)(rt_length + tr_length)
+
+# Bounded buffer with the positions of the decoded bits for the plot
+class Annotations:
+    def __init__(self, size=max_annotations):
+        self.size = size
+        self.pos = np.empty(min(size, 1024))
+        self.bits = np.empty(len(self.pos), dtype=np.int8)
+        self.count = 0
+        self.dropped = 0
+
+    # Add the bits at the positions (drops them when the buffer is full)
+    def add(self, pos, bits):
+        pos = np.atleast_1d(pos)
+        bits = np.broadcast_to(bits, pos.shape)
+
+        # Grow the arrays until the maximum size
+        needed = self.count + len(pos)
+        if needed > len(self.pos) and len(self.pos) < self.size:
+            new_len = min(self.size, max(needed, 2*len(self.pos)))
+            self.pos = np.resize(self.pos, new_len)
+            self.bits = np.resize(self.bits, new_len)
+
+        cnt = min(len(pos), len(self.pos) - self.count)
+        self.pos[self.count:self.count+cnt] = pos[:cnt]
+        self.bits[self.count:self.count+cnt] = bits[:cnt]
+        self.count += cnt
+        self.dropped += len(pos) - cnt
+
+    # Get the positions of the bits with a value
+    def get(self, bit):
+        return self.pos[:self.count][self.bits[:self.count] == bit]
 
 # Main RFID decoder
 class RFIDDecoder:
-    plt_one = []
-    plt_zero = []
+    def __init__(self, data, peak_detector='fast', reject_bad=True, calibrate=True, annotate=False):
+        # The peak detector can be given by name or as a function
+        if not callable(peak_detector):
+            peak_detector = peak_detectors[peak_detector]
+        self.peak_detector = peak_detector
+
+        # Count the good and bad frames, bad ones are only returned if they aren't rejected
+        self.reject_bad = reject_bad
+        self.good_frames = 0
+        self.bad_frames = 0
+
+        # Settings from the last Query (FM0 without pilot tone until we see one)
+        self.dr = 0
+        self.miller = 1
+        self.trext = 0
+
+        # Start from the defaults, which are calibrated on every new data when enabled
+        self.auto_calibrate = calibrate
+        self.tari = tari
+        self.tpri = tpri
+        self.min_rt_th = min_rt_th
+        self.min_tr_th = min_tr_th
+
+        # The positions of the decoded bits are only kept for the plot
+        self.annotate = annotate
 
-    def __init__(self, data):
-        self.data = data
-        self.data_inv = [-d for d in data]
+        self.trcal = -1
+        self.set_data(data)
+
+    # Set the data to decode (starting at sample offset of the capture) and find the peaks in it
+    def set_data(self, data, offset=0):
+        self.offset = offset
+        self.data = np.asarray(data)
+        if not np.issubdtype(self.data.dtype, np.floating):
+            self.data = self.data.astype(float)
+        self.annotations = Annotations() if self.annotate else None
+        if self.auto_calibrate:
+            self.calibrate()
 
         # First we find the peaks in the inverted data which could be from the Receiver
-        self.trcal = -1
-        self.peaks = find_peaks_cwt(self.data_inv, np.arange(1, 0.9*tari))
-        self.peaks = [p for p in self.peaks if (self.data[(int)(p - 0.5*tari)] - self.data[p]) > min_rt_th]
+        # (kept as a list of ints, which is a lot faster to walk trough bit by bit than an array)
+        peaks = self.peak_detector(self.data, tari=self.tari, min_rt_th=self.min_rt_th)
+        self.peaks = np.asarray(peaks, dtype=int).tolist()
         self.cur_peak = 0
         self.peak_cnt = len(self.peaks)
 
+    # Calibrate the thresholds and Tari on the start of the data
+    def calibrate(self):
+        data = self.data[:calib_len]
+        if len(data) == 0:
+            return
+
+        # Only calibrate on reader commands, the previous thresholds and Tari are kept on an idle carrier (without
+        # enough modulation depth or a delimiter) as its noise would give thresholds which decode phantom frames
+        (high, low) = estimate_levels(data)
+        if high - low < calib_depth * abs(high):
+            return
+        tari = estimate_tari(data, (high + low) / 2)
+        if tari == None:
+            return
+
+        # Scale the thresholds with the signal amplitude
+        self.min_rt_th = rt_th_ratio * (high - low)
+        self.min_tr_th = tr_th_ratio * (high - low)
+        self.tari = tari
+
+    # Decode all frames starting before limit
+    def decode(self, limit=None):
+        while self.rt_find_preamble(limit):
+            frame = self.rt_decode()
+            if frame == None:
+                continue
+
+            if frame.valid:
+                self.good_frames += 1
+            else:
+                self.bad_frames += 1
+                if self.reject_bad:
+                    continue
+            yield frame
+
+    # Get the first sample still needed after decoding up to limit
+    def first_needed(self, limit=None):
+        if limit == None:
+            limit = len(self.data)
+
+        # Keep the look-back of the first peak which wasn't used yet, unless no peak followed it for longer than a
+        # frame (it can't be part of a preamble anymore, and an idle carrier would be kept forever)
+        if self.cur_peak - 2 < self.peak_cnt:
+            first = max(self.peaks[self.cur_peak-2] - self.tari, len(self.data) - 2*frame_length(self.tari, self.tpri))
+            return max(0, min(limit, (int)(first)))
+        return limit
+
     # Get the bit
     def rt_get_bit(self, p, prev_p):
-        if 1.5*tari <= (p - prev_p) <= 2.0*tari:
+        if 1.5*self.tari <= (p - prev_p) <= 2.0*self.tari:
             return 1
         return 0
 
     # Find the R->T preamble or sync
-    def rt_find_preamble(self):
+    def rt_find_preamble(self, limit=None):
         # We need at least 3 peaks
         self.cur_peak = max(self.cur_peak, 2)
 
         # Go trough all peaks
         while self.cur_peak < self.peak_cnt:
             p_data0 = self.peaks[self.cur_peak-2]
+            if limit != None and p_data0 >= limit:
+                return False
+
             p_rtcal = self.peaks[self.cur_peak-1]
             p_trcal = self.peaks[self.cur_peak]
             rtcal = (p_rtcal - p_data0)
@@ -62,12 +376,15 @@ class RFIDDecoder:
             self.cur_peak += 1
 
             # Check if we got a Frame Sync
-            if 2.5*tari <= rtcal <= 3.0*tari:
+            if 2.5*self.tari <= rtcal <= 3.0*self.tari:
                 self.rtcal = rtcal
+                self.frame_start = p_data0
 
-                # Check if we got a preamble instead
+                # Check if we got a preamble instead (TRcal sets Tpri, so it is measured between the interpolated
+                # pulses, a rounding error would add up over long replies)
                 if 1.1*rtcal <= trcal <= 3.0*rtcal:
-                    self.trcal = trcal
+                    self.trcal = (pulse_center(self.data, p_trcal, self.tari) -
+                                  pulse_center(self.data, p_rtcal, self.tari))
                 else:
                     self.cur_peak -= 1
                 return True
@@ -78,7 +395,9 @@ class RFIDDecoder:
     # Decode RT packet
     def rt_decode(self):
         # We go trough the peaks and analyze them
-        bits = ""
+        first = self.cur_peak
+        bits = 0
+        length = 0
         cur_command = None
         while self.cur_peak < self.peak_cnt:
             p = self.peaks[self.cur_peak]
@@ -86,210 +405,477 @@ class RFIDDecoder:
 
             # Get the bit
             bit = self.rt_get_bit(p, prev_p)
-            bits += str(bit)
-
-            if bit == 1:
-                self.plt_one.append(p)
-            else:
-                self.plt_zero.append(p)
+            bits = (bits << 1) | bit
+            length += 1
 
             # Check the next peak
             self.cur_peak += 1
 
             # Check the current bits for Commands
-            if cur_command == None and len(bits) >= 2:
-                # Go trough all command and check if bits match
-                for command in commands:
-                    if command[0] == bits:
-                        cur_command = command
-                        break
+            if cur_command == None:
+                # Stop when the bits can't become a command anymore
+                if (length, bits) not in command_table:
+                    break
+                cur_command = command_table[(length, bits)]
 
             # Parse the command if finished
-            elif cur_command != None and len(bits) >= cur_command[2]:
-                real_bits = [int(bit) for bit in bits[len(cur_command[0]):]]
-                handler = getattr(self, "handle_%s" % cur_command[1], None)
+            elif length >= cur_command[2]:
+                self.rt_annotate(first, bits, length)
+                payload_len = length - len(cur_command[0])
+                payload = bits & ((1 << payload_len) - 1)
+                frame = Frame(cur_command[1], (int)(self.offset + self.frame_start), payload, payload_len)
+
+                # Check the CRC before doing anything else with the command
+                crc_len = cur_command[3]
+                if crc_len > 0:
+                    crc = bits & ((1 << crc_len) - 1)
+                    frame = frame._replace(crc=crc, valid=(crcs[crc_len].calc(bits >> crc_len, length - crc_len) == crc))
+                    if not frame.valid:
+                        return frame
 
+                handler = getattr(self, "handle_%s" % cur_command[1], None)
                 if handler:
-                    handler(real_bits)
-                else:
-                    print(cur_command[1] + ": " + bits[2:])
-
-                cur_command = None
-                return True
-
-        if len(bits) > 0:
-            print("Unknown bits: " + bits)
-        return False
-
-    # Get TR bits
-    def tr_get_bit(self, peak_val = None):
-        start = self.tr_x
-        half_tpri = (int)(start+0.5*tpri)
-        self.tr_x += tpri
-
-        # Safe the peak value for decoding
-        if peak_val != None:
-            self.peak_val = peak_val
-        else:
-            peak_val = self.peak_val
-
-        # Check which state we got
-        got_state = 0
-        if (peak_val - self.data[(int)(start)]) > min_tr_th and (peak_val - self.data[half_tpri]) > min_tr_th:
-            got_state = 1
-        elif (peak_val - self.data[(int)(start)]) > min_tr_th and (peak_val - self.data[half_tpri]) < min_tr_th:
-            got_state = 2
-        elif (peak_val - self.data[(int)(start)]) < min_tr_th and (peak_val - self.data[half_tpri]) > min_tr_th:
-            got_state = 3
-        elif (peak_val - self.data[(int)(start)]) < min_tr_th and (peak_val - self.data[half_tpri]) < min_tr_th:
-            got_state = 4
-
-        # Start state
-        if self.tr_state == 0:
-            if got_state == 1:
-                self.tr_state = got_state
-                return 1
-        # State 1
-        elif self.tr_state == 1:
-            if got_state == 4:
-                self.tr_state = got_state
-                return 1
-            elif got_state == 3:
-                self.tr_state = got_state
-                return 0
-        # State 2
-        elif self.tr_state == 2:
-            if got_state == 1:
-                self.tr_state = got_state
-                return 1
-            elif got_state == 2:
-                return 0
-        # State 3
-        elif self.tr_state == 3:
-            if got_state == 4:
-                self.tr_state = got_state
-                return 1
-            elif got_state == 3:
-                return 0
-        # State 4
-        elif self.tr_state == 4:
-            if got_state == 1:
-                self.tr_state = got_state
-                return 1
-            elif got_state == 2:
-                self.tr_state = got_state
-                return 0
-
-        # We didn't got a correct state
-        return -1
-
+                    frame = handler(frame)
+                return frame
+
+        # We couldn't find a complete command
+        if length > 0:
+            self.rt_annotate(first, bits, length)
+            return Frame(None, (int)(self.offset + self.frame_start), bits, length, valid=False)
+        return None
+
+    # Show the length bits of the R->T command decoded from the peaks starting at first in the graph (all at once,
+    # adding them bit by bit would take most of the decoding time)
+    def rt_annotate(self, first, bits, length):
+        if self.annotations != None:
+            self.annotations.add(self.peaks[first:first+length], (bits >> np.arange(length - 1, -1, -1)) & 1)
+
+    # Demodulate FM0 symbols from x in one pass, the level has to invert at the start of every symbol
+    # except at the violations, and a data-0 inverts halfway (returns the positions after every symbol,
+    # the bits, the validity of every symbol and whether the last symbol ended low)
+    def tr_fm0_symbols(self, x, count, prev_low, violations=[]):
+        xs = np.add.accumulate(np.r_[x, np.full(count, self.tpri)])
+        starts = xs[:-1]
+        starts = starts[starts + 0.5*self.tpri < len(self.data)]
+
+        # Sample both halves of all the symbols at once
+        first = self.peak_val - self.data[starts.astype(int)]
+        second = self.peak_val - self.data[(starts + 0.5*self.tpri).astype(int)]
+        first_low = first > self.min_tr_th
+        second_low = second > self.min_tr_th
+
+        # Check the level inversions
+        prev = np.empty(len(starts), dtype=bool)
+        prev[:1] = prev_low
+        prev[1:] = second_low[:-1]
+        prev[[v for v in violations if v < len(prev)]] = True
+        valid = (first != self.min_tr_th) & (second != self.min_tr_th) & (first_low != prev)
+
+        last_low = second_low[-1] if len(second_low) > 0 else prev_low
+        return (xs[1:len(starts)+1], (first_low == second_low).astype(int), valid, last_low)
+
+    # Demodulate Miller symbols from x in one pass, a data-1 inverts the phase of the subcarrier halfway
+    # (returns the same as tr_fm0_symbols)
+    def tr_miller_symbols(self, x, count, prev_low, violations=[]):
+        m = self.miller
+        xs = np.add.accumulate(np.r_[x, np.full(count, m*self.tpri)])
+        starts = xs[:-1]
+        starts = starts[starts + (m - 0.5)*self.tpri < len(self.data)]
+
+        # Sample all half subcarrier cycles of all the symbols and correlate them with the subcarrier
+        levels = self.data[(starts[:, None] + np.arange(2*m) * 0.5*self.tpri).astype(int)]
+        levels = np.where((self.peak_val - levels) > self.min_tr_th, 1, -1) * ((-1) ** np.arange(2*m))
+        first = levels[:, :m].sum(axis=1)
+        second = levels[:, m:].sum(axis=1)
+
+        # The subcarrier needs to be clean in both halves
+        valid = (np.abs(first) == m) & (np.abs(second) == m)
+        return (xs[1:len(starts)+1], (first * second < 0).astype(int), valid, prev_low)
+
+    # Demodulate the T->R symbols with the modulation set by the last Query
+    def tr_symbols(self, x, count, prev_low, violations=[]):
+        if self.miller > 1:
+            return self.tr_miller_symbols(x, count, prev_low, violations)
+        return self.tr_fm0_symbols(x, count, prev_low, violations)
+
+    # Get the T->R preamble (with the pilot tone) and the FM0 violations in it
+    def tr_get_preamble(self):
+        if self.miller > 1:
+            return ([0] * (16 if self.trext else 4) + miller_preamble, [])
+
+        pilot = 12 if self.trext else 0
+        return ([0] * pilot + tr_preamble, [pilot + tr_violation])
 
     # Find TR preamble
     def tr_find_preamble(self):
         p = self.peaks[self.cur_peak - 1]
-        peak_val = self.data[(int)(p - 0.75*tari)]
-        start = (int)(p + 0.6*tari)
-        wait_for_pulse = (int)(10 * tpri)
+        self.peak_val = self.data[(int)(p - 0.75*self.tari)]
+        start = (int)(p + 0.6*self.tari)
+        wait_for_pulse = (int)(10 * self.tpri)
 
         # Find the start of the T->R message
-        self.tr_x = 0
-        for i in range(start, start+wait_for_pulse):
-             if (peak_val-self.data[i]) > min_tr_th:
-                 self.tr_x = i + 0.25 * tpri
-                 break
-
-        # Fetch the preamble
-        self.tr_state = 0
-        for i in range(0, 6):
-            # Fix violation
-            if i == 4:
-                self.tr_state = 3
-
-            # Check the preamble
-            bit = self.tr_get_bit(peak_val)
-            if bit != tr_preamble[i]:
-                return False
-
+        low = np.flatnonzero((self.peak_val - self.data[start:start+wait_for_pulse]) > self.min_tr_th)
+        if len(low) == 0:
+            return False
+        self.tr_x = start + low[0] + 0.25 * self.tpri
+
+        # Check the preamble
+        (preamble, violations) = self.tr_get_preamble()
+        (xs, bits, valid, self.tr_low) = self.tr_symbols(self.tr_x, len(preamble), False, violations)
+        if len(bits) < len(preamble) or not valid.all() or (bits != preamble).any():
+            return False
+
+        self.tr_x = xs[-1]
         return True
 
-    # Decode TR message from start
+    # Get the mean offset of the level changes from the half symbol (or half subcarrier cycle) boundaries of the symbols
+    # starting at starts, boundaries without a change nearby are left out
+    def tr_clock_offset(self, starts):
+        half = 0.5 * self.tpri
+        bounds = (starts[:, None] + np.arange(2 * self.miller) * half - 0.5*half).ravel()
+        window = np.arange(-(int)(0.5*half), (int)(0.5*half) + 1)
+        index = bounds.astype(int)[:, None] + window
+        inside = (index[:, 0] >= 0) & (index[:, -1] < len(self.data))
+        (bounds, index) = (bounds[inside], index[inside])
+        if len(index) == 0:
+            return 0.0
+
+        # The first sample after the first change of every window
+        low = (self.peak_val - self.data[index]) > self.min_tr_th
+        change = low[:, 1:] != low[:, :-1]
+        found = change.any(axis=1)
+        if not found.any():
+            return 0.0
+        edges = index[found, 0] + 1 + np.argmax(change[found], axis=1)
+        return float(np.mean(edges - bounds[found]))
+
+    # Decode TR message from start, returns the bits packed in an integer and the amount of bits
     def tr_decode(self, bits_cnt):
-        bits = ""
-
-        # Check if we have a determined amount of bits
-        if bits_cnt > 0:
-            for i in range(0, bits_cnt):
-                bit = self.tr_get_bit()
-                # Show it in the graph
-                if bit == 1:
-                    self.plt_one.append(self.tr_x)
-                else:
-                    self.plt_zero.append(self.tr_x)
-
-                # Add the bit
-                bits += str(bit)
-        else:
-            while True:
-                bit = self.tr_get_bit()
-                # Check if it is finished
-                if bit < 0:
-                    return bits
-                else:
-                    # Show it in the graph
-                    if bit == 1:
-                        self.plt_one.append(self.tr_x)
-                    else:
-                        self.plt_zero.append(self.tr_x)
+        count = bits_cnt if bits_cnt > 0 else max_tr_bits + 1
+
+        # Demodulate a block of symbols at a time and resync the symbol clock on the level changes in the last symbols
+        # of every block, so a small error in Tpri doesn't add up over long replies
+        (xs, bits) = ([], [])
+        length = 0
+        while length < count:
+            block = min(max(1, resync_symbols // self.miller), count - length)
+            x = self.tr_x
+            (block_xs, block_bits, valid, self.tr_low) = self.tr_symbols(x, block, self.tr_low)
+
+            # Stop at the first invalid bit
+            good = (int)(np.argmin(valid)) if not valid.all() else len(valid)
+            xs.append(block_xs[:good])
+            bits.append(block_bits[:good])
+            length += good
+            if good < block:
+                break
+            self.tr_x = block_xs[-1] + self.tr_clock_offset(np.r_[x, block_xs[:-1]][-8:])
+        bits = np.concatenate(bits)
+        xs = np.concatenate(xs)
+
+        # Show it in the graph
+        if self.annotations != None:
+            self.annotations.add(xs, bits)
+        return (pack_bits(bits), length)
+
+    # Add the T->R response to the frame
+    def tr_response(self, frame, bits_cnt):
+        if self.tr_find_preamble():
+            (response, response_len) = self.tr_decode(bits_cnt)
+            frame = frame._replace(response=response, response_len=response_len)
+        return frame
 
-                    # Add the bit
-                    bits += str(bit)
-        return bits
+    # Add the RN16 of the tag replying in the slot started by the frame (colliding tags garble the reply)
+    def tr_rn16(self, frame):
+        frame = self.tr_response(frame, 16)
+        if frame.response_len == 16:
+            frame = frame._replace(rn16=frame.response)
+        return frame
 
     # Handle Query from R->T
-    def handle_Query(self, data):
-        self.dr = data[0]
-        self.trext = data[3]
-        print("Query (DR: %d, M: %d%d, TRext: %d, Sel: %d%d)" % (data[0], data[1], data[2], data[3], data[4], data[5]))
+    def handle_Query(self, frame):
+        self.dr = frame.field(0, 1)
+        self.miller = 1 << frame.field(1, 2)
+        self.trext = frame.field(3, 1)
+
+        # The backscatter link frequency is the divide ratio (DR) divided by TRcal
+        if self.auto_calibrate and self.trcal > 0:
+            self.tpri = self.trcal / (64.0/3 if self.dr else 8.0)
+        return self.tr_rn16(frame)
 
     # Handle QueryRep from R->T
-    def handle_QueryRep(self, data):
-        print("QueryRep (session: %d%d)" % (data[0], data[1]))
+    def handle_QueryRep(self, frame):
+        return self.tr_rn16(frame)
+
+    # Handle QueryAdjust from R->T
+    def handle_QueryAdjust(self, frame):
+        return self.tr_rn16(frame)
+
+    # Parse the PC, EPC and CRC-16 from the T->R response on an ACK
+    def tr_parse_epc(self, frame):
+        if frame.response == None or frame.response_len < 32:
+            return frame._replace(valid=False)
+
+        # The PC tells the length of the EPC in words (the response can end with a dummy bit)
+        pc = frame.response >> (frame.response_len - 16)
+        epc_len = 16 * (pc >> 11)
+        if frame.response_len < 32 + epc_len:
+            return frame._replace(valid=False)
+
+        bits = frame.response >> (frame.response_len - 32 - epc_len)
+        crc = bits & 0xFFFF
+        epc = (bits >> 16) & ((1 << epc_len) - 1)
+        valid = (crcs[16].calc(bits >> 16, 16 + epc_len) == crc)
+        return frame._replace(pc=pc, epc=epc, valid=valid)
 
     # Handle ACK from R->T
-    def handle_ACK(self, data):
-        print("ACK (RND16: %s)" % "".join(str(x) for x in data))
-
-        if self.tr_find_preamble():
-            print("Response: %s" % self.tr_decode(-1))
+    def handle_ACK(self, frame):
+        frame = frame._replace(rn16=frame.field(0, 16))
+        return self.tr_parse_epc(self.tr_response(frame, -1))
 
     # Handle Req_RN from R->T
-    def handle_Req_RN(self, data):
-        print("Req_RN (RND16: %s, CRC-16: %s)" % ("".join(str(x) for x in data[:16]), "".join(str(x) for x in data[16:32])))
-
-        if self.tr_find_preamble():
-            print("Response: %s" % self.tr_decode(16))
+    def handle_Req_RN(self, frame):
+        frame = frame._replace(rn16=frame.field(0, 16))
+        return self.tr_response(frame, 16)
 
     # Show the plot of data
-    def show_plot(self):
-        data = np.array(self.data)
-        plt.plot(data)                  # Add the data itself
+    def show_plot(self, max_points=max_plot_points):
+        import matplotlib.pyplot as plt
+
+        # Add the data itself, or the min/max envelope when there is too much data
+        step = max(1, -(-len(self.data) // max_points))
+        if step > 1:
+            starts = np.arange(0, len(self.data), step)
+            plt.fill_between(starts, np.minimum.reduceat(self.data, starts), np.maximum.reduceat(self.data, starts),
+                             step='post', linewidth=0)
+        else:
+            plt.plot(self.data)
 
-        # Add some debug information
-        for x in self.plt_one:
-            plt.annotate('1', xy=(x, data[x]), xycoords='data', color='g')
-        for x in self.plt_zero:
-            plt.annotate('0', xy=(x, data[x]), xycoords='data', color='r')
+        # Add some debug information (when the decoded bits were annotated)
+        for (bit, color) in ([(1, 'g'), (0, 'r')] if self.annotations != None else []):
+            x = self.annotations.get(bit)
+            plt.scatter(x, self.data[x.astype(int)], marker='$%d$' % bit, color=color)
 
         plt.show()               # Show the plot
 
+# Text formatter for the decoded frames
+class FrameFormatter:
+    # Format a frame as text
+    def format(self, frame):
+        if frame.command == None:
+            return "Unknown bits: " + bits_str(frame.payload, frame.payload_len)
+
+        formatter = getattr(self, "format_%s" % frame.command, None)
+        if formatter:
+            text = formatter(frame)
+        else:
+            text = frame.command + ": " + bits_str(frame.payload, frame.payload_len)
+        if not frame.valid:
+            text += " [bad CRC]"
+
+        # Add the T->R response
+        if frame.response != None:
+            text += "\nResponse: " + bits_str(frame.response, frame.response_len)
+        if frame.epc != None:
+            text += "\nEPC: %0*x (PC: %04x)" % (int(4 * (frame.pc >> 11)), frame.epc, frame.pc)
+        return text
+
+    # Format Query from R->T
+    def format_Query(self, frame):
+        return "Query (DR: %d, M: %s, TRext: %d, Sel: %s, session: %s, Q: %d)" % (frame.field(0, 1),
+            bits_str(frame.field(1, 2), 2), frame.field(3, 1), bits_str(frame.field(4, 2), 2),
+            bits_str(frame.field(6, 2), 2), frame.field(9, 4))
+
+    # Format QueryAdjust from R->T
+    def format_QueryAdjust(self, frame):
+        return "QueryAdjust (session: %s, UpDn: %s)" % (bits_str(frame.field(0, 2), 2), bits_str(frame.field(2, 3), 3))
+
+    # Format QueryRep from R->T
+    def format_QueryRep(self, frame):
+        return "QueryRep (session: %s)" % bits_str(frame.field(0, 2), 2)
+
+    # Format ACK from R->T
+    def format_ACK(self, frame):
+        return "ACK (RND16: %s)" % bits_str(frame.rn16, 16)
+
+    # Format Req_RN from R->T
+    def format_Req_RN(self, frame):
+        return "Req_RN (RND16: %s, CRC-16: %s)" % (bits_str(frame.rn16, 16), bits_str(frame.crc, 16))
+
+    # Print all the frames
+    def print_frames(self, frames):
+        for frame in frames:
+            print(self.format(frame))
+
+# Get the envelope of the samples, complex samples are converted to their magnitude
+def envelope(samples):
+    if np.iscomplexobj(samples):
+        return np.abs(samples)
+    return samples
+
+# Open a raw sample file memory-mapped, or None if it isn't a known raw format
+def open_samples(filename):
+    dtype = sample_formats.get(os.path.splitext(filename)[1].lower())
+    if dtype == None:
+        return None
+    if os.path.getsize(filename) == 0:
+        return np.array([], dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r')
+
+# Load all the samples from a text or raw sample file
+def load_samples(filename):
+    samples = open_samples(filename)
+    if samples is None:
+        return np.loadtxt(filename, dtype=float, ndmin=1)
+    return envelope(samples)
+
+# Read the samples from a text or raw sample file in chunks
+def read_chunks(filename, size=chunk_size):
+    samples = open_samples(filename)
+    if samples is not None:
+        for i in range(0, len(samples), size):
+            yield envelope(samples[i:i+size])
+        return
+
+    with open(filename) as f:
+        while True:
+            chunk = np.array([float(line) for line in islice(f, size)])
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+# Convert a text sample file to a raw sample file
+def convert_samples(in_filename, out_filename):
+    dtype = sample_formats[os.path.splitext(out_filename)[1].lower()]
+    with open(out_filename, 'wb') as f:
+        for chunk in read_chunks(in_filename):
+            chunk.astype(dtype).tofile(f)
+
+# Decode samples arriving in chunks (starting at sample offset) while only keeping an overlap window in memory
+def decode_stream(chunks, decoder=None, offset=0):
+    if decoder == None:
+        decoder = RFIDDecoder([])
+    overlap = frame_length(decoder.tari, decoder.tpri)
+    buf = np.array([])
+
+    for chunk in chunks:
+        buf = np.concatenate((buf, chunk))
+        if len(buf) < 2*overlap:
+            continue
+
+        # Only decode frames which completely fit in the buffer
+        decoder.set_data(buf, offset)
+        limit = len(buf) - overlap
+        for frame in decoder.decode(limit):
+            yield frame
+
+        # Drop the samples which aren't needed anymore
+        needed = decoder.first_needed(limit)
+        buf = buf[needed:]
+        offset += needed
+        overlap = frame_length(decoder.tari, decoder.tpri)
+
+    # Decode whatever is left at the end of the stream
+    decoder.set_data(buf, offset)
+    for frame in decoder.decode():
+        yield frame
+
+# Find all the captures in a list of files, directories and glob patterns
+def find_captures(paths):
+    extensions = ['.txt'] + list(sample_formats)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            files += [os.path.join(path, name) for name in names if os.path.splitext(name)[1].lower() in extensions]
+        else:
+            files += sorted(glob.glob(path))
+    return files
+
+# Convert a frame to a dictionary for the results file
+def frame_dict(frame):
+    return {
+        'command': frame.command,
+        'offset': frame.offset,
+        'payload': bits_str(frame.payload, frame.payload_len),
+        'rn16': frame.rn16,
+        'pc': frame.pc,
+        'epc': None if frame.epc == None else "%0*x" % (int(4 * (frame.pc >> 11)), frame.epc),
+        'crc': frame.crc,
+        'response': None if frame.response == None else bits_str(frame.response, frame.response_len),
+        'valid': frame.valid,
+    }
+
+# Decode a single capture in a batch and time it
+def decode_file(filename, peak_detector='fast'):
+    result = {'file': filename, 'samples': 0, 'good_frames': 0, 'bad_frames': 0, 'frames': [], 'error': None}
+    start = time.time()
+    try:
+        decoder = RFIDDecoder([], peak_detector)
+        chunks = read_chunks(filename)
+        for frame in decode_stream(chunks, decoder):
+            result['frames'].append(frame_dict(frame))
+        result['samples'] = decoder.offset + len(decoder.data)
+        result['good_frames'] = decoder.good_frames
+        result['bad_frames'] = decoder.bad_frames
+    except Exception as e:
+        result['error'] = "%s: %s" % (type(e).__name__, e)
+    result['seconds'] = time.time() - start
+    return result
+
+# Decode all captures in parallel and write the results to one JSONL or CSV file
+def decode_batch(files, output_file, workers=workers, peak_detector='fast'):
+    start = time.time()
+    frames = 0
+    with open(output_file, 'w') as f:
+        # CSV only gets a line per capture, JSONL also contains the frames
+        use_csv = os.path.splitext(output_file)[1].lower() == '.csv'
+        if use_csv:
+            fields = ['file', 'samples', 'good_frames', 'bad_frames', 'seconds', 'error']
+            writer = csv.DictWriter(f, fields, extrasaction='ignore')
+            writer.writeheader()
+
+        pool = Pool(workers)
+        for result in pool.imap(partial(decode_file, peak_detector=peak_detector), files):
+            if use_csv:
+                writer.writerow(result)
+            else:
+                f.write(json.dumps(result) + "\n")
+
+            frames += result['good_frames']
+            print("%s: %d good, %d bad frames in %.2fs%s" % (result['file'], result['good_frames'],
+                result['bad_frames'], result['seconds'], " (%s)" % result['error'] if result['error'] else ""))
+        pool.close()
+        pool.join()
+
+    print("Decoded %d frames from %d captures in %.2fs" % (frames, len(files), time.time() - start))
+
 # Main function
 def main():
-    with open("signal.txt") as f:
-        data = map(float, f)
-
-    decoder = RFIDDecoder(data)
-    while decoder.rt_find_preamble():
-        decoder.rt_decode()
+    # Setup the option parser
+    parser = OptionParser(usage="usage: %prog [options] [capture ...]")
+    parser.add_option("-b", "--batch",
+        dest="batch", action="store_true", default=False, help="Decode all captures (files, directories or globs) without plotting")
+    parser.add_option("-j", "--workers",
+        dest="workers", type="int", default=workers, help="Amount of worker processes in batch mode")
+    parser.add_option("-o", "--output_file",
+        dest="output_file", type="string", default=output_file, help="The batch results file (.jsonl or .csv)")
+    parser.add_option("-d", "--peak_detector",
+        dest="peak_detector", type="choice", choices=sorted(peak_detectors), default='fast', help="The peak detector to use")
+
+    # Parse the options
+    (options, args) = parser.parse_args()
+
+    # Decode all captures in batch mode
+    if options.batch:
+        decode_batch(find_captures(args or ["."]), options.output_file, options.workers, options.peak_detector)
+        return
+
+    # Decode and plot a single capture
+    data = load_samples(args[0] if args else input_file)
+    decoder = RFIDDecoder(data, options.peak_detector, annotate=True)
+    FrameFormatter().print_frames(decoder.decode())
+    print("Frames: %d good, %d bad" % (decoder.good_frames, decoder.bad_frames))
     decoder.show_plot()
 
 if __name__ == "__main__":
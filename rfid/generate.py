@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+from optparse import OptionParser
+import os
+import numpy as np
+from decode import commands, crcs, pack_bits, tr_preamble, tr_violation, miller_preamble, sample_formats, tari, tpri
+
+# Some defines for the generated signal (all lengths are in samples)
+samples = 1000000    # Amount of samples to generate
+tags = 4             # Amount of tags in the field of the reader
+q = 2                # Q of the inventory rounds (2^Q slots per round)
+miller = 1           # 1 for FM0, or 2, 4 or 8 for the Miller subcarrier
+trext = 0            # Send the pilot tone in front of the T->R preamble
+dr = 1               # Divide ratio of the Query (0 for DR=8, 1 for DR=64/3)
+depth = 0.06         # Depth of the tag modulation relative to the carrier
+noise = 0.003        # Standard deviation of the noise relative to the carrier
+drift = 0.02         # Amplitude of the DC drift relative to the carrier
+seed = 0             # Seed of the random generator
+output_file = "synthetic.f32"           # The generated capture
+
+###### ------------ Code starts here ------------ ######
+# Commands by their name
+command_codes = dict((command[1], command) for command in commands)
+
+# Get the bits (packed in an integer) and the length of a command with its payload and CRC
+def command_bits(name, payload=0, payload_len=0):
+    (code, _, length, crc_len) = command_codes[name]
+    bits = (int(code, 2) << payload_len) | payload
+    length = len(code) + payload_len
+    if crc_len > 0:
+        bits = (bits << crc_len) | crcs[crc_len].calc(bits, length)
+        length += crc_len
+    return (bits, length)
+
+# Unpack an integer to a list of length bits (MSB first)
+def unpack_bits(value, length):
+    return [(value >> i) & 1 for i in range(length - 1, -1, -1)]
+
+# Synthetic EPC Gen2 baseband (the envelope of the reader carrier) generator
+class Gen2Generator:
+    def __init__(self, tari=tari, tpri=tpri, dr=dr, miller=miller, trext=trext, depth=depth, noise=noise,
+                 drift=drift, seed=seed):
+        self.dr = dr
+        self.miller = miller
+        self.trext = trext
+        self.depth = depth
+        self.noise = noise
+        self.drift = drift
+        self.random = np.random.RandomState(seed)
+
+        # PIE timing in whole samples so every pulse gets the same shape, TRcal sets Tpri like the decoder calibrates it
+        self.tari = int(round(tari))
+        self.pw = int(round(0.24 * tari))
+        self.rise = self.pw
+        self.data1 = int(round(1.75 * tari))
+        self.rtcal = self.tari + self.data1
+        self.trcal = int(round(tpri * (64.0/3 if dr else 8.0)))
+        self.tpri = self.trcal / (64.0/3 if dr else 8.0)
+        self.delimiter = int(round(1.5 * tari))
+        self.t4 = 2 * self.rtcal
+        if not 1.1*self.rtcal <= self.trcal <= 3.0*self.rtcal:
+            raise ValueError("TRcal of %.1f samples is outside 1.1-3 RTcal, change Tpri or DR" % self.trcal)
+
+        # The rendered pieces of the reader envelope and tag modulation and the sent commands
+        self.time = 0.0
+        self.reader = []
+        self.tag = []
+        self.commands = []
+
+    # Render levels lasting durations from the current time, the edges are rounded to samples
+    def render(self, durations, levels):
+        edges = np.floor(self.time + np.r_[0, np.cumsum(durations)] + 0.5).astype(int)
+        self.time += np.sum(durations)
+        return np.repeat(np.asarray(levels, dtype=np.float32), np.diff(edges))
+
+    # Add the continuous wave of the reader
+    def add_cw(self, duration):
+        piece = self.render([duration], [1])
+        self.reader.append(piece)
+        self.tag.append(np.zeros_like(piece))
+
+    # Add a PIE encoded R->T command (with a preamble instead of a frame sync on a Query)
+    def add_command(self, name, payload=0, payload_len=0):
+        (bits, length) = command_bits(name, payload, payload_len)
+        self.commands.append((int(round(self.time)), name, bits, length))
+
+        # Every symbol ends with a low pulse of width PW
+        symbols = [self.tari, self.rtcal] + ([self.trcal] if name == 'Query' else [])
+        symbols += [self.data1 if bit else self.tari for bit in unpack_bits(bits, length)]
+        durations = [self.delimiter]
+        for symbol in symbols:
+            durations += [symbol - self.pw, self.pw]
+        piece = self.render(durations, [0] + [1, 0] * len(symbols))
+        self.reader.append(piece)
+        self.tag.append(np.zeros_like(piece))
+
+    # Get the half symbol levels (1 is modulated) of an FM0 reply, the level inverts at the start of
+    # every symbol except at the violations, and halfway a data-0
+    def fm0_levels(self, bits, violations):
+        levels = []
+        level = 0
+        for (i, bit) in enumerate(bits):
+            if i not in violations:
+                level ^= 1
+            levels.append(level)
+            if bit == 0:
+                level ^= 1
+            levels.append(level)
+        return (levels, [0.5 * self.tpri] * len(levels))
+
+    # Get the half subcarrier cycle levels of a Miller reply, the subcarrier inverts every half cycle,
+    # a data-1 inverts its phase halfway and a data-0 following a data-0 at its start
+    def miller_cycles(self, bits):
+        m = self.miller
+        levels = []
+        phase = 1
+        prev = 1
+        for bit in bits:
+            if bit == 0 and prev == 0:
+                phase ^= 1
+            levels += [phase ^ (k % 2) for k in range(m)]
+            phase ^= bit
+            levels += [phase ^ (k % 2) for k in range(m, 2*m)]
+            prev = bit
+        return (levels, [0.5 * self.tpri] * len(levels))
+
+    # Render a T->R reply of bits (with the preamble and the dummy 1 at the end) from the current time
+    def render_reply(self, value, length):
+        bits = unpack_bits(value, length) + [1]
+        if self.miller > 1:
+            bits = [0] * (16 if self.trext else 4) + miller_preamble + bits
+            (levels, durations) = self.miller_cycles(bits)
+        else:
+            pilot = 12 if self.trext else 0
+            bits = [0] * pilot + tr_preamble + bits
+            (levels, durations) = self.fm0_levels(bits, [pilot + tr_violation])
+        return self.render(durations, levels)
+
+    # Add the T->R replies of one or more (colliding) tags after a command
+    def add_reply(self, replies):
+        self.add_cw(0.75 * self.tari + 3 * self.tpri)
+        start = self.time
+        pieces = []
+        end = start
+        for (value, length) in replies:
+            self.time = start
+            pieces.append(self.render_reply(value, length))
+            end = max(end, self.time)
+        self.time = end
+
+        # Colliding tags modulate at the same time
+        tag = np.zeros(max(len(piece) for piece in pieces), dtype=np.float32)
+        for piece in pieces:
+            tag[:len(piece)] = np.maximum(tag[:len(piece)], piece)
+        self.reader.append(np.ones_like(tag))
+        self.tag.append(tag)
+        self.add_cw(10 * self.tpri)
+
+    # Add an inventory round, every tag replies in a random slot and is read when it is alone in it
+    def add_round(self, epcs, q=q, session=0):
+        slots = self.random.randint(0, 1 << q, len(epcs))
+        for slot in range(1 << q):
+            if slot == 0:
+                query = (self.dr << 12) | ((self.miller.bit_length() - 1) << 10) | (self.trext << 9) | (session << 5) | q
+                self.add_command('Query', query, 13)
+            else:
+                self.add_command('QueryRep', session, 2)
+
+            # Every tag in the slot backscatters a RN16
+            tags = [epc for (epc, s) in zip(epcs, slots) if s == slot]
+            rn16s = [int(rn16) for rn16 in self.random.randint(0, 1 << 16, len(tags))]
+            if len(tags) == 0:
+                self.add_cw(self.t4)
+                continue
+            self.add_reply([(rn16, 16) for rn16 in rn16s])
+            if len(tags) > 1:
+                continue
+
+            # Acknowledge the tag to get its EPC, and request a handle
+            (epc, epc_len) = tags[0]
+            pc = (epc_len // 16) << 11
+            bits = (pc << epc_len) | epc
+            bits = (bits << 16) | crcs[16].calc(bits, 16 + epc_len)
+            self.add_command('ACK', rn16s[0], 16)
+            self.add_reply([(bits, 32 + epc_len)])
+
+            handle = int(self.random.randint(0, 1 << 16))
+            self.add_command('Req_RN', rn16s[0], 16)
+            self.add_reply([((handle << 16) | crcs[16].calc(handle, 16), 32)])
+
+    # Generate inventory rounds of random tags until there are enough samples
+    def generate(self, samples=samples, tags=tags, q=q):
+        epcs = [(pack_bits(self.random.randint(0, 2, 96)), 96) for i in range(tags)]
+        self.add_cw(5 * self.tari)
+        while self.time < samples:
+            self.add_round(epcs, q)
+
+        # Shape the reader pulses and combine them with the tag modulation
+        reader = np.concatenate(self.reader)[:samples]
+        tag = np.concatenate(self.tag)[:samples]
+        ramp = np.ones(self.rise) / self.rise
+        data = np.convolve(reader, ramp, mode='same') * (1 - self.depth * tag)
+
+        # Add the DC drift and the noise
+        t = np.arange(len(data)) / float(len(data))
+        data += self.drift * np.sin(2*np.pi*t + self.random.uniform(0, 2*np.pi))
+        data += self.random.normal(0, self.noise, len(data))
+        return data.astype(np.float32)
+
+# Write the samples to a text or raw sample file
+def save_samples(filename, data):
+    dtype = sample_formats.get(os.path.splitext(filename)[1].lower())
+    if dtype == None:
+        np.savetxt(filename, data)
+    else:
+        data.astype(dtype).tofile(filename)
+
+# Main function
+def main():
+    # Setup the option parser
+    parser = OptionParser(usage="usage: %prog [options] [output_file]",
+        description="Generate a synthetic EPC Gen2 capture of inventory rounds. " +
+            "The format is selected by the output extension: .txt, " + ", ".join(sorted(sample_formats)))
+    parser.add_option("-n", "--samples",
+        dest="samples", type="int", default=samples, help="Amount of samples to generate")
+    parser.add_option("-t", "--tari",
+        dest="tari", type="float", default=tari, help="Tari in samples")
+    parser.add_option("-p", "--tpri",
+        dest="tpri", type="float", default=tpri, help="Tpri (one over the link frequency) in samples")
+    parser.add_option("-m", "--miller",
+        dest="miller", type="choice", choices=["1", "2", "4", "8"], default=str(miller), help="1 for FM0, or the Miller M")
+    parser.add_option("-e", "--trext",
+        dest="trext", action="store_true", default=bool(trext), help="Send the pilot tone")
+    parser.add_option("-g", "--tags",
+        dest="tags", type="int", default=tags, help="Amount of tags")
+    parser.add_option("-q", "--q",
+        dest="q", type="int", default=q, help="Q of the inventory rounds")
+    parser.add_option("-N", "--noise",
+        dest="noise", type="float", default=noise, help="Noise relative to the carrier")
+    parser.add_option("-D", "--drift",
+        dest="drift", type="float", default=drift, help="DC drift relative to the carrier")
+    parser.add_option("-s", "--seed",
+        dest="seed", type="int", default=seed, help="Seed of the random generator")
+
+    # Parse the options
+    (options, args) = parser.parse_args()
+    filename = args[0] if args else output_file
+
+    generator = Gen2Generator(options.tari, options.tpri, dr, int(options.miller), int(options.trext),
+                              depth, options.noise, options.drift, options.seed)
+    data = generator.generate(options.samples, options.tags, options.q)
+    save_samples(filename, data)
+    print("Generated %d commands in %d samples" % (len(generator.commands), len(data)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+from optparse import OptionParser
+import csv
+import json
+import math
+import os
+from decode import RFIDDecoder, decode_stream, read_chunks, peak_detectors
+
+# Some defines for the inventory tracking
+rate = 2000000          # Sample rate of the captures, to get the read rate in tags per second
+output_file = None      # The round metrics file (.jsonl or .csv)
+
+###### ------------ Code starts here ------------ ######
+# Fields of the round metrics
+round_fields = ['round', 'offset', 'duration', 'q', 'session', 'slots', 'empty', 'single', 'collisions', 'reads',
+                'bad_reads', 'read_rate', 'collision_rate', 'utilization', 'estimated_tags', 'suggested_q']
+
+# State of a tag seen in the inventory
+class TagState:
+    __slots__ = ('epc', 'pc', 'reads', 'accesses', 'rounds', 'first', 'last', 'rn16')
+
+    def __init__(self, epc, pc, offset):
+        self.epc = epc
+        self.pc = pc
+        self.reads = 0
+        self.accesses = 0
+        self.rounds = 0
+        self.first = offset
+        self.last = offset
+        self.rn16 = None
+
+    # Get the EPC as hex string
+    def epc_str(self):
+        return "%0*x" % (int(4 * (self.pc >> 11)), self.epc)
+
+# Tracker of the inventory rounds started by a Query or QueryAdjust, and the tags read in them
+class InventoryTracker:
+    def __init__(self, rate=rate):
+        self.rate = rate
+        self.tags = {}          # Tag states by EPC
+        self.rounds = []        # Metrics of the finished rounds
+        self.round = None
+        self.q = 0
+
+    # Start a new round on a Query or QueryAdjust
+    def start_round(self, frame, q, session):
+        self.finish(frame.offset)
+        self.q = q
+        self.round = dict((field, 0) for field in round_fields)
+        self.round.update({'round': len(self.rounds), 'offset': frame.offset, 'q': q, 'session': session})
+        self.round_tags = {}    # EPCs by the RN16 they used in this round
+        self.round_reads = set()
+        self.start_slot(frame)
+
+    # Start a slot, the RN16 reply tells if it is empty, has a single tag or has colliding tags
+    def start_slot(self, frame):
+        self.round['slots'] += 1
+        self.slot_rn16 = frame.rn16
+        self.last = frame.offset
+        if frame.response == None:
+            self.round['empty'] += 1
+        elif frame.rn16 == None:
+            self.round['collisions'] += 1
+        else:
+            self.round['single'] += 1
+
+    # Add a decoded frame
+    def add(self, frame):
+        # A Query or QueryAdjust with a bad CRC would start a round with the Q and session of corrupt bits
+        if frame.command in ('Query', 'QueryAdjust') and not frame.valid:
+            return
+
+        if frame.command == 'Query':
+            self.start_round(frame, frame.field(9, 4), frame.field(6, 2))
+        elif frame.command == 'QueryAdjust':
+            updn = frame.field(2, 3)
+            q = min(15, self.q + 1) if updn == 0b110 else max(0, self.q - 1) if updn == 0b011 else self.q
+            self.start_round(frame, q, frame.field(0, 2))
+
+        # Other commands only count within a round
+        elif self.round == None:
+            return
+        elif frame.command == 'QueryRep':
+            if frame.field(0, 2) == self.round['session']:
+                self.start_slot(frame)
+        elif frame.command == 'ACK' and frame.rn16 == self.slot_rn16:
+            self.last = frame.offset
+            if frame.epc == None or not frame.valid:
+                self.round['bad_reads'] += 1
+                return
+            self.read(frame)
+        elif frame.command == 'Req_RN' and frame.valid and frame.rn16 in self.round_tags:
+            self.last = frame.offset
+            self.tags[self.round_tags[frame.rn16]].accesses += 1
+
+    # Update the state of a tag read by an ACK
+    def read(self, frame):
+        tag = self.tags.get(frame.epc)
+        if tag == None:
+            tag = self.tags[frame.epc] = TagState(frame.epc, frame.pc, frame.offset)
+        tag.reads += 1
+        tag.last = frame.offset
+        tag.rn16 = frame.rn16
+        if frame.epc not in self.round_reads:
+            tag.rounds += 1
+            self.round_reads.add(frame.epc)
+        self.round_tags[frame.rn16] = frame.epc
+        self.round['reads'] += 1
+
+    # Finish the current round at sample end (the start of the next round or the end of the capture)
+    def finish(self, end=None):
+        if self.round == None:
+            return
+        r = self.round
+        r['duration'] = (end if end != None else self.last) - r['offset']
+        r['read_rate'] = r['reads'] * self.rate / float(r['duration']) if r['duration'] > 0 else 0.0
+        r['collision_rate'] = r['collisions'] / float(r['slots'])
+        r['utilization'] = r['single'] / float(r['slots'])
+
+        # Estimate the tag population from the collisions (Schoute) and the Q which has a slot for every tag
+        r['estimated_tags'] = r['single'] + 2.39 * r['collisions']
+        r['suggested_q'] = min(15, int(round(math.log(r['estimated_tags'], 2)))) if r['estimated_tags'] >= 1 else 0
+        self.rounds.append(r)
+        self.round = None
+
+    # Get the metrics over all finished rounds
+    def summary(self):
+        slots = sum(r['slots'] for r in self.rounds)
+        duration = sum(r['duration'] for r in self.rounds)
+        reads = sum(r['reads'] for r in self.rounds)
+        return {
+            'rounds': len(self.rounds),
+            'slots': slots,
+            'reads': reads,
+            'tags': len(self.tags),
+            'read_rate': reads * self.rate / float(duration) if duration > 0 else 0.0,
+            'collision_rate': sum(r['collisions'] for r in self.rounds) / float(slots) if slots else 0.0,
+            'utilization': sum(r['single'] for r in self.rounds) / float(slots) if slots else 0.0,
+        }
+
+# Write the round metrics to a JSONL or CSV file
+def write_metrics(rounds, filename):
+    with open(filename, 'w') as f:
+        if os.path.splitext(filename)[1].lower() == '.csv':
+            writer = csv.DictWriter(f, round_fields)
+            writer.writeheader()
+            writer.writerows(rounds)
+        else:
+            for r in rounds:
+                f.write(json.dumps(r) + "\n")
+
+# Main function
+def main():
+    # Setup the option parser
+    parser = OptionParser(usage="usage: %prog [options] capture",
+        description="Track the inventory rounds of a capture and report the round and tag metrics.")
+    parser.add_option("-r", "--rate",
+        dest="rate", type="float", default=rate, help="Sample rate of the capture")
+    parser.add_option("-o", "--output_file",
+        dest="output_file", type="string", default=output_file, help="Write the round metrics to a .jsonl or .csv file")
+    parser.add_option("-d", "--peak_detector",
+        dest="peak_detector", type="choice", choices=sorted(peak_detectors), default='fast', help="The peak detector to use")
+
+    # Parse the options
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Expected a capture")
+
+    # Track all frames, including the ones with a bad CRC
+    tracker = InventoryTracker(options.rate)
+    for frame in decode_stream(read_chunks(args[0]), RFIDDecoder([], options.peak_detector, reject_bad=False)):
+        tracker.add(frame)
+    tracker.finish()
+
+    print("%5s %4s %5s %5s %6s %5s %5s %9s %7s %6s" % ("round", "Q", "slots", "empty", "single", "coll", "reads",
+        "tags/s", "util", "sug. Q"))
+    for r in tracker.rounds:
+        print("%5d %4d %5d %5d %6d %5d %5d %9.1f %6.1f%% %6d" % (r['round'], r['q'], r['slots'], r['empty'], r['single'],
+            r['collisions'], r['reads'], r['read_rate'], 100 * r['utilization'], r['suggested_q']))
+
+    print("\n%-24s %5s %6s %8s" % ("EPC", "reads", "rounds", "accesses"))
+    for tag in sorted(tracker.tags.values(), key=lambda tag: tag.first):
+        print("%-24s %5d %6d %8d" % (tag.epc_str(), tag.reads, tag.rounds, tag.accesses))
+
+    summary = tracker.summary()
+    print("\n%d rounds, %d slots, %d reads of %d tags: %.1f tags/s, %.1f%% collisions, %.1f%% utilization" % (
+        summary['rounds'], summary['slots'], summary['reads'], summary['tags'], summary['read_rate'],
+        100 * summary['collision_rate'], 100 * summary['utilization']))
+
+    if options.output_file:
+        write_metrics(tracker.rounds, options.output_file)
+
+if __name__ == "__main__":
+    main()
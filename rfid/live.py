@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+from collections import deque
+from optparse import OptionParser
+import socket
+import sys
+import threading
+import time
+import numpy as np
+from decode import RFIDDecoder, FrameFormatter, decode_stream, envelope, read_chunks, peak_detectors
+
+# Some defines for live decoding
+source = "-"            # Where the samples come from (see open_source)
+rate = 2000000          # Sample rate, only used to replay files at the real speed and for the statistics
+block_size = 131072     # Amount of samples decoded at once (more samples are less work per sample)
+max_wait = 0.1          # Maximum amount of seconds to wait for a full block before decoding a smaller one
+max_backlog = 4194304   # Maximum amount of received samples waiting to be decoded, newer samples are dropped
+read_size = 16384       # Amount of samples read from the source at once
+stats_interval = 5.0    # Seconds between the statistics lines
+
+###### ------------ Code starts here ------------ ######
+# Received samples waiting to be decoded, bounded to max_backlog samples by dropping new samples
+class SampleQueue:
+    def __init__(self, max_backlog=max_backlog):
+        self.max_backlog = max_backlog
+        self.items = deque()        # (dropped samples before, arrival time, samples)
+        self.backlog = 0
+        self.received = 0
+        self.dropped = 0
+        self.pending_drop = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    # Add received samples, or drop them when the backlog is full
+    def put(self, samples):
+        with self.cond:
+            self.received += len(samples)
+            if self.backlog + len(samples) > self.max_backlog:
+                self.dropped += len(samples)
+                self.pending_drop += len(samples)
+                return
+
+            self.items.append((self.pending_drop, time.time(), samples))
+            self.pending_drop = 0
+            self.backlog += len(samples)
+            self.cond.notify()
+
+    # Mark the end of the stream
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    # Get up to size contiguous samples, waiting at most timeout seconds for them (returns a list of
+    # (dropped samples before, arrival time, samples), which is empty at the end of the stream)
+    def get(self, size, timeout=max_wait):
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.backlog < size and not self.closed and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+
+            # Stop at a gap of dropped samples, unless it is before the first item
+            items = []
+            count = 0
+            while self.items and count < size and (len(items) == 0 or self.items[0][0] == 0):
+                items.append(self.items.popleft())
+                count += len(items[-1][2])
+            self.backlog -= count
+            return items
+
+    # Check if all samples were taken at the end of the stream
+    def finished(self):
+        with self.cond:
+            return self.closed and not self.items
+
+# Decoder of a live stream of samples, which reports the latency of every frame
+class LiveDecoder:
+    def __init__(self, queue, decoder=None, block_size=block_size, max_wait=max_wait):
+        self.queue = queue
+        self.decoder = decoder if decoder != None else RFIDDecoder([])
+        self.block_size = block_size
+        self.max_wait = max_wait
+
+        # Position in the stream (including the dropped samples) and the arrival times of the samples
+        self.samples = 0
+        self.arrivals = deque()     # (first sample after the chunk, arrival time)
+        self.pending = []
+        self.gap = 0
+        self.frames = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    # Get contiguous chunks of samples until a gap of dropped samples or the end of the stream
+    def chunks(self):
+        while self.pending or not self.queue.finished():
+            items = self.pending or self.queue.get(self.block_size, self.max_wait)
+            self.pending = []
+            if len(items) == 0:
+                continue
+
+            # Stop this stream at the gap, the items are decoded in the next one
+            if items[0][0] > 0:
+                self.gap = items[0][0]
+                self.pending = [(0, items[0][1], items[0][2])] + items[1:]
+                return
+
+            # The decoder doesn't look back before the start of its last window anymore, so the arrival times of
+            # the samples before it aren't needed (also when no frames are decoded)
+            while len(self.arrivals) > 1 and self.arrivals[0][0] <= self.decoder.offset:
+                self.arrivals.popleft()
+
+            chunk = np.concatenate([item[2] for item in items])
+            for item in items:
+                self.samples += len(item[2])
+                self.arrivals.append((self.samples, item[1]))
+            yield chunk
+
+    # Get the time since the first sample of a frame arrived
+    def latency(self, frame):
+        while len(self.arrivals) > 1 and self.arrivals[0][0] <= frame.offset:
+            self.arrivals.popleft()
+        return time.time() - self.arrivals[0][1]
+
+    # Decode the frames of the stream with their latency
+    def decode(self):
+        while self.pending or not self.queue.finished():
+            for frame in decode_stream(self.chunks(), self.decoder, self.samples):
+                latency = self.latency(frame)
+                self.frames += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+                yield (frame, latency)
+
+            # Continue after the gap in the stream
+            self.samples += self.gap
+            self.gap = 0
+
+    # Get a statistics line
+    def stats(self, elapsed):
+        return "%.1fs: %d samples (%.2f MS/s), %d dropped, %d frames, latency %.1f ms mean, %.1f ms max" % (
+            elapsed, self.queue.received, self.queue.received / elapsed / 1e6 if elapsed > 0 else 0,
+            self.queue.dropped, self.frames, 1e3 * self.total_latency / self.frames if self.frames else 0,
+            1e3 * self.max_latency)
+
+# Convert a byte stream to samples of dtype, keeping the bytes of incomplete samples for the next read
+def byte_samples(reads, dtype):
+    size = np.dtype(dtype).itemsize
+    rest = b""
+    for data in reads:
+        data = rest + data
+        end = len(data) - len(data) % size
+        rest = data[end:]
+        if end > 0:
+            yield envelope(np.frombuffer(data[:end], dtype=dtype))
+
+# Read the samples from a stream (stdin or a TCP connection)
+def stream_samples(f, dtype):
+    size = read_size * np.dtype(dtype).itemsize
+    return byte_samples(iter(lambda: f.read(size), b""), dtype)
+
+# Receive the samples from UDP datagrams
+def udp_samples(host, port, dtype):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * read_size * np.dtype(dtype).itemsize)
+    sock.bind((host, port))
+    return byte_samples(iter(lambda: sock.recv(65536), None), dtype)
+
+# Receive the samples from a ZeroMQ publisher (like the GNU Radio ZMQ PUB sink)
+def zmq_samples(address, dtype):
+    import zmq
+    sock = zmq.Context().socket(zmq.SUB)
+    sock.connect(address)
+    sock.setsockopt(zmq.SUBSCRIBE, b"")
+    return byte_samples(iter(sock.recv, None), dtype)
+
+# Replay a capture file at the sample rate as a stand-in for a live source
+def replay_samples(filename, rate=rate):
+    start = time.time()
+    count = 0
+    for chunk in read_chunks(filename, read_size):
+        count += len(chunk)
+        time.sleep(max(0, start + count / float(rate) - time.time()))
+        yield chunk
+
+# Open a source of samples: - for stdin, tcp://host:port, udp://host:port, zmq+tcp://host:port or a capture file
+def open_source(source, dtype=np.float32, rate=rate):
+    if source == "-":
+        return stream_samples(getattr(sys.stdin, 'buffer', sys.stdin), dtype)
+    if source.startswith("zmq+"):
+        return zmq_samples(source[4:], dtype)
+    if source.startswith("tcp://") or source.startswith("udp://"):
+        (host, port) = source[6:].rsplit(":", 1)
+        if source.startswith("udp://"):
+            return udp_samples(host, int(port), dtype)
+        return stream_samples(socket.create_connection((host, int(port))).makefile('rb'), dtype)
+    return replay_samples(source, rate)
+
+# Read all samples of a source into the queue (run in a separate thread)
+def receive(samples, queue):
+    try:
+        for chunk in samples:
+            queue.put(chunk)
+    finally:
+        queue.close()
+
+# Print the statistics line of the live decoder every interval seconds until stop is set (run in a separate thread,
+# so they are also printed while no frames are decoded)
+def report_stats(live, start, stop, interval=stats_interval):
+    while not stop.wait(interval):
+        print(live.stats(time.time() - start))
+
+# Main function
+def main():
+    # Setup the option parser
+    parser = OptionParser(usage="usage: %prog [options] [source]",
+        description="Decode a live stream of samples. The source is - for float32 samples on stdin, " +
+            "tcp://host:port, udp://host:port, zmq+tcp://host:port (a ZeroMQ publisher), or a capture file " +
+            "which is replayed at the sample rate.")
+    parser.add_option("-c", "--complex",
+        dest="complex", action="store_true", default=False, help="The stream contains complex64 samples")
+    parser.add_option("-r", "--rate",
+        dest="rate", type="float", default=rate, help="Sample rate to replay capture files at")
+    parser.add_option("-B", "--block_size",
+        dest="block_size", type="int", default=block_size, help="Amount of samples decoded at once")
+    parser.add_option("-w", "--max_wait",
+        dest="max_wait", type="float", default=max_wait, help="Maximum seconds to wait for a full block")
+    parser.add_option("-l", "--max_backlog",
+        dest="max_backlog", type="int", default=max_backlog, help="Maximum amount of samples waiting to be decoded")
+    parser.add_option("-d", "--peak_detector",
+        dest="peak_detector", type="choice", choices=sorted(peak_detectors), default='fast', help="The peak detector to use")
+    parser.add_option("-q", "--quiet",
+        dest="quiet", action="store_true", default=False, help="Only print the statistics")
+
+    # Parse the options
+    (options, args) = parser.parse_args()
+    try:
+        samples = open_source(args[0] if args else source, np.complex64 if options.complex else np.float32, options.rate)
+    except ImportError:
+        parser.error("ZeroMQ sources need pyzmq")
+
+    # Receive in the background while decoding
+    queue = SampleQueue(options.max_backlog)
+    thread = threading.Thread(target=receive, args=(samples, queue))
+    thread.daemon = True
+    thread.start()
+
+    live = LiveDecoder(queue, RFIDDecoder([], options.peak_detector), options.block_size, options.max_wait)
+    formatter = FrameFormatter()
+    start = time.time()
+    stop = threading.Event()
+    reporter = threading.Thread(target=report_stats, args=(live, start, stop))
+    reporter.daemon = True
+    reporter.start()
+    try:
+        for (frame, latency) in live.decode():
+            if not options.quiet:
+                print("%s (latency: %.1f ms)" % (formatter.format(frame), 1e3 * latency))
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    print(live.stats(time.time() - start))
+
+if __name__ == "__main__":
+    main()